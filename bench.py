@@ -0,0 +1,332 @@
+"""
+Benchmark for installing a .mrpack, runnable offline.
+
+Generates a synthetic pack shaped like example.json, serves its files from a
+local stand-in CDN that can add latency, cap bandwidth and fail requests, then
+times each phase of an install and prints the results as JSON.
+
+    python bench.py --files 200 --latency 0.05 --bandwidth 2M --repeat 3 -o bench.json
+"""
+from lib import Downloader, FileCache, download_files, extract_overrides, select_files, read_index, place_tree, hash_file, LINK_MODES, \
+    check_modloader, modloader_version_id, load_launcher_profiles, save_launcher_profiles, add_modpack_profile, Metrics, parse_size, InstallError
+from main import unpack_mrpack
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+PHASES = ("extract", "download", "verify", "place", "profile")
+
+# Synthetic packs
+def make_pack(out_dir: str, base_url: str, files: int = 68, median_size: int = 256 * 1024, spread: float = 1.5,
+              max_size: int = 64 * 1024 ** 2, overrides: int = 50, override_size: int = 4096, seed: int = 0):
+    """Write a .mrpack plus the files it references into out_dir.
+
+    File sizes follow a log-normal distribution around median_size, which is
+    roughly what real packs look like: mostly small mods with a few large ones.
+    Returns the path of the .mrpack and the directory to serve.
+    """
+    rng = random.Random(seed)
+    serve_dir = os.path.join(out_dir, "cdn")
+    os.makedirs(serve_dir, exist_ok=True)
+    entries = []
+    for i in range(files):
+        size = max(1, min(max_size, int(rng.lognormvariate(math.log(median_size), spread))))
+        data = rng.randbytes(size)
+        # About one file in twelve is a resource pack, like example.json
+        folder, ext = ("resourcepacks", "zip") if i % 12 == 11 else ("mods", "jar")
+        name = f"file{i:05d}.{ext}"
+        with open(os.path.join(serve_dir, name), 'wb') as f:
+            f.write(data)
+        entries.append({
+            "path": f"{folder}/{name}",
+            "hashes": {"sha1": hashlib.sha1(data).hexdigest(), "sha512": hashlib.sha512(data).hexdigest()},
+            "env": {"client": "required", "server": "required"},
+            "downloads": [f"{base_url}/{name}"],
+            "fileSize": size
+        })
+    index = {
+        "game": "minecraft",
+        "formatVersion": 1,
+        "versionId": "1.0.0",
+        "name": "BenchPack",
+        "summary": "",
+        "files": entries,
+        "dependencies": {"fabric-loader": "0.16.14", "minecraft": "1.21.1"}
+    }
+    mrpack_path = os.path.join(out_dir, "bench.mrpack")
+    with zipfile.ZipFile(mrpack_path, 'w') as z:
+        z.writestr("modrinth.index.json", json.dumps(index, indent=1))
+        for i in range(overrides):
+            z.writestr(f"overrides/config/bench/config{i:05d}.json", rng.randbytes(override_size).hex()[:override_size])
+    return mrpack_path, serve_dir
+
+def fake_minecraft_dir(path: str, index: dict):
+    """An empty .minecraft with a launcher_profiles.json and the pack's modloader already "installed",
+    so the benchmark never runs an installer or touches the network"""
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "launcher_profiles.json"), 'w', encoding='utf-8') as f:
+        json.dump({"profiles": {}, "settings": {}, "version": 3}, f)
+    version_id = modloader_version_id(check_modloader(index["dependencies"]))
+    os.makedirs(os.path.join(path, "versions", version_id), exist_ok=True)
+    with open(os.path.join(path, "versions", version_id, f"{version_id}.json"), 'w', encoding='utf-8') as f:
+        json.dump({"id": version_id}, f)
+
+# Stand-in CDN
+class CDNHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def handle(self):
+        # Called once per TCP connection, however many requests it carries
+        with self.server.lock:
+            self.server.stats["connections"] += 1
+        super().handle()
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.stats["requests"] += 1
+            fail = server.rng.random() < server.error_rate
+        if server.latency:
+            time.sleep(server.latency)
+        if fail:
+            with server.lock:
+                server.stats["errors"] += 1
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        path = os.path.join(server.root, os.path.basename(self.path))
+        if not os.path.isfile(path):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        range_header = self.headers.get("Range")
+        if range_header and range_header.startswith("bytes="):
+            first, _, last = range_header[6:].partition("-")
+            start = int(first) if first else 0
+            end = int(last) if last else size - 1
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        self.send_body(path, start, end - start + 1)
+
+    def send_body(self, path: str, offset: int, length: int):
+        chunk = 16 * 1024
+        started = time.monotonic()
+        sent = 0
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while sent < length:
+                data = f.read(min(chunk, length - sent))
+                if not data:
+                    break
+                self.wfile.write(data)
+                sent += len(data)
+                if self.server.bandwidth:
+                    # Sleep until this connection is back under its bandwidth cap
+                    ahead = sent / self.server.bandwidth - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        with self.server.lock:
+            self.server.stats["bytes"] += sent
+
+    def log_message(self, format, *args):
+        pass
+
+def start_cdn(root: str, latency: float = 0.0, bandwidth: int = 0, error_rate: float = 0.0, seed: int = 0):
+    """Serve root on a free local port from a background thread. bandwidth is bytes/second per connection, 0 for no cap"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CDNHandler)
+    server.daemon_threads = True
+    server.root = root
+    server.latency = latency
+    server.bandwidth = bandwidth
+    server.error_rate = error_rate
+    server.rng = random.Random(seed)
+    server.lock = threading.Lock()
+    server.stats = {"requests": 0, "errors": 0, "bytes": 0, "connections": 0}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# Timed runs
+def run_phases(mrpack_path: str, work_dir: str, minecraft_dir: str, jobs: int, per_host: int, cache_dir, link_mode: str):
+    """Install the pack one phase at a time, in the order unpack_mrpack runs them, timing each.
+    unpack_mrpack overlaps some of these, so the sum can be more than an end to end run."""
+    timings = {}
+    staging = os.path.join(work_dir, "instance")
+    instance = os.path.join(work_dir, "profile")
+    index = read_index(mrpack_path)
+    files = select_files(index.get("files", []))
+
+    started = time.perf_counter()
+    extract_overrides(mrpack_path, staging)
+    timings["extract"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    downloader = Downloader(pool_size=max(jobs, per_host), per_host=per_host)
+    cache = FileCache(cache_dir) if cache_dir else None
+    failures = download_files(files, staging, jobs, per_host, downloader, cache)
+    timings["download"] = time.perf_counter() - started
+    if failures:
+        raise RuntimeError(f"{len(failures)} files failed to download")
+
+    started = time.perf_counter()
+    for entry in files:
+        if hash_file(os.path.join(staging, entry["path"]), "sha512") != entry["hashes"]["sha512"]:
+            raise RuntimeError(f"{entry['path']} doesn't match its sha512")
+    timings["verify"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    place_tree(staging, instance, link_mode)
+    timings["place"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    modloader = check_modloader(index["dependencies"])
+    profiles_data = load_launcher_profiles(minecraft_dir)
+    add_modpack_profile(profiles_data, index["name"], modloader["minecraft"], modloader_version_id(modloader), instance)
+    save_launcher_profiles(profiles_data, minecraft_dir)
+    timings["profile"] = time.perf_counter() - started
+
+    timings["total"] = sum(timings.values())
+    return timings
+
+def run_end_to_end(mrpack_path: str, work_dir: str, minecraft_dir: str, jobs: int, per_host: int, cache_dir, link_mode: str):
+    """Time a whole unpack_mrpack call, with its output hidden. Also returns the phase timings it recorded itself"""
+    metrics = Metrics()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        try:
+            unpack_mrpack(mrpack_path, minecraft_dir=minecraft_dir, profile_dir=os.path.join(work_dir, "profile"), jobs=jobs, per_host=per_host,
+                          use_cache=cache_dir is not None, cache_dir=cache_dir, link_mode=link_mode, workspace=work_dir,
+                          metrics=metrics)
+        except InstallError as e:
+            raise RuntimeError(f"unpack_mrpack failed: {e}") from e
+    return time.perf_counter() - started, metrics.summary()["phases"]
+
+def summarize(values: list):
+    return {
+        "min": min(values),
+        "median": statistics.median(values),
+        "mean": statistics.fmean(values),
+        "max": max(values)
+    }
+
+def main(argv=None):
+    argp = argparse.ArgumentParser(description="Benchmark installing a synthetic .mrpack from a local stand-in CDN")
+    argp.add_argument("--files", type=int, default=68, help="Number of files in the pack (default: 68, like example.json)")
+    argp.add_argument("--median-size", type=parse_size, default=256 * 1024, help="Median file size, e.g. 256K (default: 256K)")
+    argp.add_argument("--spread", type=float, default=1.5, help="Sigma of the log-normal file size distribution; 0 makes every file the median size (default: 1.5)")
+    argp.add_argument("--max-size", type=parse_size, default=64 * 1024 ** 2, help="Largest file to generate (default: 64M)")
+    argp.add_argument("--overrides", type=int, default=50, help="Number of files in overrides/ (default: 50)")
+    argp.add_argument("--override-size", type=parse_size, default=4096, help="Size of each override file (default: 4K)")
+    argp.add_argument("--latency", type=float, default=0.0, help="Seconds the CDN waits before answering each request (default: 0)")
+    argp.add_argument("--bandwidth", type=parse_size, default=0, help="Bytes per second per connection, e.g. 2M; 0 for no cap (default: 0)")
+    argp.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests the CDN answers with 503 (default: 0)")
+    argp.add_argument("-j", "--jobs", type=int, default=8, help="Number of files to download at once (default: 8)")
+    argp.add_argument("--per-host", type=int, default=4, help="Maximum simultaneous downloads from one host (default: 4)")
+    argp.add_argument("--link-mode", choices=LINK_MODES, default="move", help="How to place the instance (default: move)")
+    argp.add_argument("--warm-cache", action='store_true', help="Keep a download cache between runs, so every run after the first is served from it")
+    argp.add_argument("--repeat", type=int, default=3, help="Number of timed runs (default: 3)")
+    argp.add_argument("--no-end-to-end", action='store_true', help="Only time the phases separately, not a whole unpack_mrpack call")
+    argp.add_argument("--seed", type=int, default=0, help="Seed for the generated pack and injected errors (default: 0)")
+    argp.add_argument("--keep", action='store_true', help="Don't delete the generated pack and work directories")
+    argp.add_argument("-o", "--output", type=str, help="Write the JSON results here instead of stdout")
+    args = argp.parse_args(argv)
+
+    root = tempfile.mkdtemp(prefix="mrunpack-bench-")
+    try:
+        # The CDN needs a port before the pack can name its URLs, so start it on the (still empty) serve directory
+        server = start_cdn(os.path.join(root, "cdn"), args.latency, args.bandwidth, args.error_rate, args.seed)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        started = time.perf_counter()
+        mrpack_path, _ = make_pack(root, base_url, args.files, args.median_size, args.spread, args.max_size,
+                                   args.overrides, args.override_size, args.seed)
+        generate_time = time.perf_counter() - started
+        index = read_index(mrpack_path)
+        total_bytes = sum(entry["fileSize"] for entry in index["files"])
+        cache_dir = os.path.join(root, "cache") if args.warm_cache else None
+
+        runs = []
+        for run in range(args.repeat):
+            result = {"run": run}
+            for mode in ("phases", "end_to_end"):
+                if mode == "end_to_end" and args.no_end_to_end:
+                    continue
+                work_dir = os.path.join(root, f"run{run}-{mode}")
+                minecraft_dir = os.path.join(work_dir, ".minecraft")
+                fake_minecraft_dir(minecraft_dir, index)
+                before = dict(server.stats)
+                if mode == "phases":
+                    result["phases"] = run_phases(mrpack_path, work_dir, minecraft_dir, args.jobs, args.per_host, cache_dir, args.link_mode)
+                else:
+                    result["end_to_end"], result["end_to_end_phases"] = run_end_to_end(mrpack_path, work_dir, minecraft_dir, args.jobs, args.per_host, cache_dir, args.link_mode)
+                result[f"{mode}_server"] = {key: server.stats[key] - before[key] for key in before}
+                if result[f"{mode}_server"]["connections"] > max(args.jobs, args.per_host):
+                    # More connections than can ever be open at once means some weren't reused
+                    print(f"Warning: run {run} ({mode}) opened {result[f'{mode}_server']['connections']} connections "
+                          f"for {result[f'{mode}_server']['requests']} requests; keep-alive isn't working", file=sys.stderr)
+                shutil.rmtree(work_dir, ignore_errors=True)
+            runs.append(result)
+        server.shutdown()
+
+        summary = {phase: summarize([run["phases"][phase] for run in runs]) for phase in PHASES + ("total",)}
+        if not args.no_end_to_end:
+            summary["end_to_end"] = summarize([run["end_to_end"] for run in runs])
+        summary["download_throughput"] = total_bytes / summary["download"]["median"] if summary["download"]["median"] else None
+        results = {
+            "config": {key: value for key, value in vars(args).items() if key not in ("output", "keep")},
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count()
+            },
+            "pack": {
+                "files": len(index["files"]),
+                "bytes": total_bytes,
+                "overrides": args.overrides,
+                "generate_seconds": generate_time
+            },
+            "runs": runs,
+            "summary": summary
+        }
+    finally:
+        if args.keep:
+            print(f"Benchmark files kept in {root}", file=sys.stderr)
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    return results
+
+if __name__ == "__main__":
+    main()
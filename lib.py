@@ -1,35 +1,1317 @@
 import logging
+import argparse
+import json as parse
+import os
+import time
+import random
+import threading
+import hashlib
+import itertools
+import glob
+import shutil
+import http.client
+import zipfile
+import fnmatch
+import zlib
+import mmap
+import subprocess
+import uuid
+import asyncio
+import queue
+import socket
+import socketserver
+from collections import Counter, deque, OrderedDict
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED, CancelledError
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from typing import Optional
+import requests
+from tqdm import tqdm
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 logger = logging.getLogger(__name__)
 # Json Parser
-import json as parse
 def jsonparse(json: str):
     dict = parse.loads(json)
     return(dict)
+# Size Parser
+def parse_size(text: str):
+    """Byte count from a size like 500M or 20G, for argparse"""
+    units = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    number = text.strip().upper().removesuffix("B").removesuffix("I")
+    unit = number[-1:] if number[-1:] in units else ""
+    try:
+        size = int(float(number[:len(number) - len(unit)]) * units[unit])
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{text!r} isn't a size like 500M or 20G")
+    if size < 0:
+        raise argparse.ArgumentTypeError(f"{text!r} is negative")
+    return size
+# Install Metrics
+class Metrics:
+    """Timings and counters collected during an install, for a JSON report or live hooks.
+
+    Phases are recorded with span() and files with file(). Functions passed to
+    add_hook(fn) are called as fn(event, record) for every "span" and "file"
+    record as it is made, from whichever thread made it.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = datetime.now(timezone.utc)
+        self.clock = time.monotonic()
+        self.spans = []
+        self.files = []
+        self.hooks = []
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def emit(self, event: str, record: dict):
+        for hook in list(self.hooks):
+            try:
+                hook(event, record)
+            except Exception as e:
+                logger.warning(f"Metrics hook {hook!r} failed: {e}")
+
+    @contextmanager
+    def span(self, name: str, **labels):
+        """Time the body of a with block as the phase name"""
+        start = time.monotonic()
+        record = {"name": name, **labels, "start": start - self.clock}
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = str(e) or type(e).__name__
+            raise
+        finally:
+            record["seconds"] = time.monotonic() - start
+            with self.lock:
+                self.spans.append(record)
+            self.emit("span", record)
+
+    def file(self, path: str, source: str, size: int = 0, **fields):
+        """Record how one file was obtained. source is one of "network", "cache", "shared"
+        (fetched for another pack in this run), "journal" (done by an earlier run) or "failed"
+        """
+        record = {"path": path, "source": source, "size": size, **fields, "end": time.monotonic() - self.clock}
+        with self.lock:
+            self.files.append(record)
+        self.emit("file", record)
+
+    def summary(self):
+        with self.lock:
+            spans, files = list(self.spans), list(self.files)
+        sources = Counter(record["source"] for record in files)
+        network = [record for record in files if record["source"] == "network"]
+        # Transfers overlap, so throughput is bytes over the wall time from the first start to the last end
+        def wall_time(intervals):
+            intervals = list(intervals)
+            return max(end for _, end in intervals) - min(start for start, _ in intervals) if intervals else 0.0
+        hosts = {}
+        for record in network:
+            stats = hosts.setdefault(record.get("host"), {"files": 0, "bytes": 0, "seconds": 0.0, "retries": 0})
+            stats["files"] += 1
+            stats["bytes"] += record.get("bytes", 0)
+            stats["seconds"] += record.get("seconds", 0.0)
+            stats["retries"] += record.get("attempts", 1) - 1
+        for host, stats in hosts.items():
+            seconds = wall_time((record["end"] - record.get("seconds", 0.0), record["end"])
+                                for record in network if record.get("host") == host)
+            stats["throughput"] = stats["bytes"] / seconds if seconds else None
+        phases = {}
+        for record in spans:
+            phases[record["name"]] = phases.get(record["name"], 0.0) + record["seconds"]
+        fetched = sources["network"] + sources["cache"] + sources["shared"]
+        downloaded = sum(record.get("bytes", 0) for record in network)
+        # Packs installed side by side each have a "files" span, so span them all rather than adding them up
+        download_time = wall_time((record["start"], record["start"] + record["seconds"])
+                                  for record in spans if record["name"] == "files")
+        return {
+            "elapsed": time.monotonic() - self.clock,
+            "phases": phases,
+            "files": len(files),
+            "sources": dict(sources),
+            "cache_hit_rate": (sources["cache"] + sources["shared"]) / fetched if fetched else None,
+            "bytes_downloaded": downloaded,
+            "throughput": downloaded / download_time if download_time else None,
+            "retries": sum(stats["retries"] for stats in hosts.values()),
+            "hosts": hosts
+        }
+
+    def report(self):
+        with self.lock:
+            spans, files = list(self.spans), list(self.files)
+        return {"started": self.started.isoformat(), "summary": self.summary(), "spans": spans, "files": files}
+
+    def write(self, path: str):
+        tmp = path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            parse.dump(self.report(), f, indent=2)
+        os.replace(tmp, path)
+
+    def describe(self):
+        """One line for the end of a run"""
+        summary = self.summary()
+        text = f"{summary['files']} files in {summary['elapsed']:.1f}s, {summary['bytes_downloaded'] / 1048576:.1f} MiB downloaded"
+        if summary["throughput"]:
+            text += f" at {summary['throughput'] / 1048576:.1f} MiB/s"
+        if summary["cache_hit_rate"] is not None:
+            text += f", {summary['cache_hit_rate']:.0%} served from cache"
+        if summary["retries"]:
+            text += f", {summary['retries']} retries"
+        return text
+
 # File Downloader
-import requests
-import shutil
-import os
-from tqdm import tqdm
-def download(url, path):
-    logger.info(f"Downloading {url} to {path}")
-    if url == "":
-        raise ValueError("Supply a URL to download.")
-    dir = os.path.dirname(path)
-    response = requests.get(url, stream=True)
-    if response.status_code == 200:
-        if not os.path.exists(dir):
-            os.makedirs(dir)
-        
-        # Get file size for progress bar
-        total_size = int(response.headers.get('content-length', 0))
-        filename = os.path.basename(path)
-        
-        with open(path, 'wb') as f:
-            with tqdm(total=total_size, unit='B', unit_scale=True, desc=filename, leave=False) as pbar:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        pbar.update(len(chunk))
+class DownloadError(Exception):
+    """Raised when a file can't be fetched, even after retrying"""
+
+class IntegrityError(DownloadError):
+    """Raised when downloaded data doesn't match the manifest's hashes or fileSize"""
+
+class TransientError(DownloadError):
+    """A failure worth retrying, possibly on another mirror, after `delay` seconds"""
+    def __init__(self, message: str, delay: Optional[float] = None):
+        super().__init__(message)
+        self.delay = delay
+
+class DownloadCancelled(DownloadError):
+    """Raised when a download is stopped through its cancel event"""
+
+# Bandwidth is handed out to waiting transfers in this order
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+class Bandwidth:
+    """Token bucket pacing every transfer that shares it to `rate` bytes per second (None or 0 for no cap).
+
+    Transfers may run up to `burst` seconds ahead of the rate before they have
+    to wait for more bytes. While a higher priority class is waiting, lower
+    ones get nothing, so e.g. an installer jar isn't held up by a big mod.
+    """
+    def __init__(self, rate: Optional[float] = None, burst: float = 0.25):
+        if rate is not None and rate < 0:
+            raise ValueError(f"Can't cap bandwidth at {rate} bytes per second")
+        self.cond = threading.Condition()
+        self.rate = rate or None
+        self.burst = burst
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.waiting = Counter()
+
+    def set_rate(self, rate: Optional[float]):
+        if rate is not None and rate < 0:
+            raise ValueError(f"Can't cap bandwidth at {rate} bytes per second")
+        with self.cond:
+            self.rate = rate or None
+            self.cond.notify_all()
+
+    def take(self, nbytes: int, priority: str = "normal"):
+        """Wait until nbytes more may be transferred"""
+        if self.rate is None:
+            return
+        rank = PRIORITIES[priority]
+        with self.cond:
+            self.waiting[rank] += 1
+            try:
+                while self.rate is not None:
+                    now = time.monotonic()
+                    self.tokens = min(self.rate * self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    ahead = any(count for other, count in self.waiting.items() if other < rank)
+                    if self.tokens > 0 and not ahead:
+                        # A read bigger than what's left borrows from the future; the next one waits it out
+                        self.tokens -= nbytes
+                        return
+                    self.cond.wait(-self.tokens / self.rate + 0.001 if self.tokens <= 0 else self.burst)
+            finally:
+                self.waiting[rank] -= 1
+                self.cond.notify_all()
+
+# Shared by every Downloader that isn't given one of its own; the CLI's --limit-rate sets it
+default_bandwidth = Bandwidth()
+
+class Downloader:
+    """Shared HTTP session that keeps connections alive between files and retries
+    transient failures (429, 5xx, dropped connections, stalls) with exponential
+    backoff, failing over between the mirrors listed for a file. Every byte
+    read is paced by `bandwidth`, default_bandwidth unless one is passed in.
+    """
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, TransientError)
+    # Bodies are read in chunks between these sizes, aiming for about CHUNK_SECONDS per read
+    MIN_CHUNK = 64 * 1024
+    MAX_CHUNK = 4 * 1024 * 1024
+    CHUNK_SECONDS = 0.05
+
+    def __init__(self, pool_size: int = 16, retries: int = 5, backoff: float = 0.5,
+                 max_backoff: float = 60.0, timeout: float = 30.0, per_host: int = 4, race: bool = False,
+                 bandwidth: Optional[Bandwidth] = None):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # Also the stall timeout: a mirror that sends nothing for this long is abandoned
+        self.timeout = timeout
+        self.per_host = max(1, per_host)
+        self.race = race
+        self.bandwidth = bandwidth if bandwidth is not None else default_bandwidth
+        self.lock = threading.Lock()
+        self.host_slots = {}
+        self.host_stats = {}
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=max(pool_size, self.per_host))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def host_slot(self, url: str):
+        """Semaphore limiting how many transfers run against url's host at once"""
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self.host_slots[host]
+
+    def record(self, url: str, nbytes: int, seconds: float, failed: bool = False):
+        """Remember how a transfer from url's host went, for ranking mirrors later in the run"""
+        host = urlparse(url).netloc
+        with self.lock:
+            stats = self.host_stats.setdefault(host, {"bytes": 0, "seconds": 0.0, "failures": 0})
+            stats["bytes"] += nbytes
+            stats["seconds"] += seconds
+            if failed:
+                stats["failures"] += 1
+            else:
+                stats["failures"] = max(0, stats["failures"] - 1)
+
+    def rank_mirrors(self, urls: list):
+        """Order mirrors by how their hosts have behaved so far: fewest recent failures, then fastest"""
+        def score(item):
+            index, url = item
+            stats = self.host_stats.get(urlparse(url).netloc)
+            if stats is None:
+                return (0, 0, index)
+            throughput = stats["bytes"] / stats["seconds"] if stats["seconds"] else 0
+            return (stats["failures"], -throughput, index)
+        with self.lock:
+            return [url for index, url in sorted(enumerate(urls), key=score)]
+
+    def retry_delay(self, attempt: int, response=None):
+        """Seconds to wait before the next attempt, honoring Retry-After when the server sent one"""
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(self.max_backoff, max(0.0, float(retry_after)))
+            except ValueError:
+                try:
+                    when = parsedate_to_datetime(retry_after)
+                    return min(self.max_backoff, max(0.0, when.timestamp() - time.time()))
+                except (TypeError, ValueError):
+                    pass
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def open(self, url: str, headers: dict):
+        """GET url inside its host slot. Returns (response, slot); the caller releases the slot."""
+        slot = self.host_slot(url)
+        slot.acquire()
+        try:
+            return self.session.get(url, stream=True, timeout=self.timeout, headers=headers), slot
+        except BaseException:
+            slot.release()
+            raise
+
+    def body_chunks(self, response, priority: str = "normal"):
+        """Yield response's body as memoryviews over one reused buffer, sized to the transfer rate.
+
+        Each view is only valid until the next one is requested. Uncompressed
+        bodies are read from the socket straight into the buffer; compressed ones
+        go through requests' decoder as usual. Reads are paced by the bandwidth
+        cap, at `priority`.
+        """
+        encoding = response.headers.get("Content-Encoding", "identity").lower()
+        # urllib3's readinto() reads into a temporary bytes object and copies it, so use the http.client response under it
+        fp = getattr(response.raw, "_fp", None)
+        if encoding not in ("", "identity") or not hasattr(fp, "readinto"):
+            for chunk in response.iter_content(chunk_size=self.MIN_CHUNK):
+                self.bandwidth.take(len(chunk), priority)
+                yield memoryview(chunk)
+            return
+        length = response.headers.get("Content-Length")
+        remaining = int(length) if length and length.isdigit() else None
+        size = self.MIN_CHUNK
+        buffer = memoryview(bytearray(size))
+        # Under a cap, reads bigger than one burst would make the pacing lumpy
+        rate = self.bandwidth.rate
+        ceiling = self.MAX_CHUNK if rate is None else max(self.MIN_CHUNK, min(self.MAX_CHUNK, int(rate * self.bandwidth.burst)))
+        while True:
+            started = time.monotonic()
+            try:
+                n = fp.readinto(buffer[:size])
+            except (http.client.HTTPException, OSError) as e:
+                # Surface the same errors requests would have, so they're retried
+                raise requests.ConnectionError(e) from e
+            elapsed = time.monotonic() - started
+            if not n:
+                # http.client doesn't treat a short body as an error, but urllib3 would have
+                if remaining:
+                    raise requests.exceptions.ChunkedEncodingError(f"Connection closed with {remaining} bytes still to come")
+                # Tell requests the body is done, so closing the response puts the connection back in the pool
+                response._content_consumed = True
+                return
+            if remaining is not None:
+                remaining -= n
+            self.bandwidth.take(n, priority)
+            yield buffer[:n]
+            if n == size and elapsed < self.CHUNK_SECONDS / 2 and size < ceiling:
+                size *= 2
+                if size > len(buffer):
+                    buffer = memoryview(bytearray(size))
+            elif elapsed > self.CHUNK_SECONDS and size > self.MIN_CHUNK:
+                size //= 2
+
+    def race_open(self, mirrors: list, headers: dict, priority: str = "normal"):
+        """Request the first two mirrors at once and keep whichever delivers its first bytes first.
+
+        Returns (url, response, slot, chunks), chunks being body_chunks(response) with
+        the first chunk put back in front; the losing requests are closed. If
+        neither wins, mirrors that don't have the file are removed from `mirrors`.
+        """
+        urls = mirrors[:2]
+        lock = threading.Lock()
+        decided = threading.Event()
+        winner = {}
+        errors = []
+        missing = []
+        def attempt(url):
+            response = slot = None
+            try:
+                response, slot = self.open(url, headers)
+                if response.status_code in self.RETRY_STATUSES:
+                    raise TransientError(f"{url} returned HTTP {response.status_code}", self.retry_delay(0, response))
+                if response.status_code not in (200, 206):
+                    with lock:
+                        missing.append(url)
+                    raise DownloadError(f"{url} returned HTTP {response.status_code}")
+                chunks = self.body_chunks(response, priority)
+                first_chunk = next(chunks, None)
+            except Exception as e:
+                if response is not None:
+                    response.close()
+                if slot is not None:
+                    slot.release()
+                with lock:
+                    errors.append(e)
+                    if len(errors) == len(urls):
+                        decided.set()
+                return
+            with lock:
+                if not winner:
+                    if first_chunk is not None:
+                        chunks = itertools.chain([first_chunk], chunks)
+                    winner.update(url=url, response=response, slot=slot, chunks=chunks)
+                    decided.set()
+                    return
+            response.close()
+            slot.release()
+        for url in urls:
+            threading.Thread(target=attempt, args=(url,), daemon=True).start()
+        decided.wait()
+        with lock:
+            if not winner:
+                for url in missing:
+                    logger.warning(f"{url} doesn't have the file, dropping it")
+                    mirrors.remove(url)
+                if not mirrors:
+                    raise errors[0]
+                transient = [e for e in errors if isinstance(e, TransientError)]
+                # Move straight on to the mirrors left when the ones raced just didn't have it
+                raise transient[0] if transient else TransientError(str(errors[0]), 0)
+            logger.info(f"{winner['url']} won the race for first bytes")
+            return winner["url"], winner["response"], winner["slot"], winner["chunks"]
+
+    def download(self, urls, path, pbar=None, hashes: Optional[dict] = None, size: Optional[int] = None,
+                 resume: bool = False, cancel: Optional[threading.Event] = None, priority: str = "normal"):
+        """Stream a file from urls (one URL or a list of mirrors) to path, checking hashes and size.
+
+        Data goes to path + ".part", which is only renamed into place once it
+        checks out; dropped connections continue with a Range request, on the
+        next mirror if there is one. resume=True continues a .part file left by
+        an earlier run and keeps it on failure. Returns the URL and host it came
+        from, attempts, bytes, time to first byte and total seconds.
+        """
+        if isinstance(urls, str):
+            urls = [urls]
+        urls = [url for url in urls if url]
+        if not urls:
+            raise ValueError("Supply a URL to download.")
+        logger.info(f"Downloading {urls[0]} to {path}")
+        dir = os.path.dirname(path)
+        part_path = path + ".part"
+        expected = {algorithm: digest.lower() for algorithm, digest in (hashes or {}).items()
+                    if algorithm in hashlib.algorithms_available and digest}
+        if not resume and os.path.exists(part_path):
+            os.remove(part_path)
+        mirrors = self.rank_mirrors(urls)
+        position = 0
+        validator = None
+        reported = 0
+        transferred = 0
+        began = time.monotonic()
+        last_error = None
+        for attempt in range(max(self.retries + 1, len(mirrors))):
+            if cancel is not None and cancel.is_set():
+                raise DownloadCancelled(f"Download of {os.path.basename(path)} was cancelled")
+            url = mirrors[position % len(mirrors)]
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            headers = {}
+            if offset:
+                headers["Range"] = f"bytes={offset}-"
+                if validator and validator[0] == url:
+                    headers["If-Range"] = validator[1]
+            started = time.monotonic()
+            written = offset
+            slot = None
+            try:
+                if attempt == 0 and self.race and len(mirrors) > 1:
+                    url, response, slot, chunks = self.race_open(mirrors, headers, priority)
+                else:
+                    response, slot = self.open(url, headers)
+                    chunks = self.body_chunks(response, priority)
+                first_byte = None
+                with response:
+                    if response.status_code in self.RETRY_STATUSES:
+                        raise TransientError(f"{url} returned HTTP {response.status_code}",
+                                             self.retry_delay(position // len(mirrors), response))
+                    if response.status_code == 416 and offset:
+                        # The partial file doesn't fit what the server has; start over
+                        os.remove(part_path)
+                        raise TransientError(f"{url} rejected the resume range", 0)
+                    if response.status_code not in (200, 206) or (response.status_code == 206 and not offset):
+                        if len(mirrors) == 1:
+                            raise DownloadError(f"{url} returned HTTP {response.status_code}")
+                        # This mirror doesn't have the file; drop it and use the others
+                        logger.warning(f"{url} returned HTTP {response.status_code}, trying another mirror")
+                        mirrors.remove(url)
+                        continue
+                    if response.status_code == 200:
+                        offset = written = 0
+                    validator = (url, response.headers.get("ETag") or response.headers.get("Last-Modified"))
+                    if dir and not os.path.exists(dir):
+                        os.makedirs(dir, exist_ok=True)
+
+                    # Get file size for progress bar
+                    total_size = offset + int(response.headers.get('content-length', 0))
+                    filename = os.path.basename(path)
+
+                    # Reuse the caller's bar or Progress when downloading as part of a batch (see download_files)
+                    if pbar is None:
+                        bar = tqdm(total=total_size, initial=offset, unit='B', unit_scale=True, desc=filename, leave=False)
+                    else:
+                        bar = nullcontext(pbar)
+                    hashers = [hashlib.new(algorithm) for algorithm in expected]
+                    if offset:
+                        # Hash state can't be saved, so catch up on the bytes we already have
+                        with open(part_path, 'rb') as f:
+                            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                                for hasher in hashers:
+                                    hasher.update(chunk)
+                    with open(part_path, 'ab' if offset else 'wb') as f:
+                        with bar as progress:
+                            if pbar is not None:
+                                pbar.update(offset - reported)
+                            try:
+                                for chunk in chunks:
+                                    if first_byte is None:
+                                        first_byte = time.monotonic() - started
+                                    if cancel is not None and cancel.is_set():
+                                        raise DownloadCancelled(f"Download of {os.path.basename(path)} was cancelled")
+                                    f.write(chunk)
+                                    for hasher in hashers:
+                                        hasher.update(chunk)
+                                    n = len(chunk)
+                                    written += n
+                                    progress.update(n)
+                            finally:
+                                # Everything written has been reported, so there's no need to count both per chunk
+                                reported = written
+                self.record(url, written - offset, time.monotonic() - started)
+                transferred += written - offset
+                try:
+                    if size is not None and written != size:
+                        raise IntegrityError(f"{url} is {written} bytes, expected {size}")
+                    for hasher in hashers:
+                        if hasher.hexdigest() != expected[hasher.name]:
+                            raise IntegrityError(f"{url} has {hasher.name} {hasher.hexdigest()}, expected {expected[hasher.name]}")
+                    os.replace(part_path, path)
+                except Exception as e:
+                    os.remove(part_path)
+                    if pbar is not None:
+                        pbar.update(-reported)
+                    reported = 0
+                    if not isinstance(e, IntegrityError) or len(mirrors) == 1:
+                        raise
+                    # This mirror serves a bad copy; the others may not
+                    logger.warning(f"{e}, trying another mirror")
+                    self.record(url, 0, 0, failed=True)
+                    mirrors.remove(url)
+                    last_error = e
+                    continue
+                return {"url": url, "host": urlparse(url).netloc, "attempts": attempt + 1, "bytes": transferred,
+                        "first_byte": first_byte, "seconds": time.monotonic() - began}
+            except self.RETRY_EXCEPTIONS as e:
+                self.record(url, written - offset, time.monotonic() - started, failed=True)
+                transferred += written - offset
+                last_error = e
+                position += 1
+                if position % len(mirrors):
+                    logger.warning(f"Download from {url} failed ({e}), trying {mirrors[position % len(mirrors)]}")
+                    continue
+                delay = e.delay if isinstance(e, TransientError) and e.delay is not None else self.retry_delay(position // len(mirrors))
+                logger.warning(f"Download from {url} failed ({e}), retrying in {delay:.1f}s")
+                if cancel is not None:
+                    cancel.wait(delay)
+                else:
+                    time.sleep(delay)
+            finally:
+                if slot is not None:
+                    slot.release()
+        if pbar is not None:
+            pbar.update(-reported)
+        if not resume and os.path.exists(part_path):
+            os.remove(part_path)
+        raise DownloadError(f"Failed to download {os.path.basename(path)}: {last_error}") from last_error
+
+_downloader = None
+_downloader_lock = threading.Lock()
+def get_downloader():
+    """Return the process-wide Downloader, creating it on first use"""
+    global _downloader
+    with _downloader_lock:
+        if _downloader is None:
+            _downloader = Downloader()
+        return _downloader
+
+def download(url, path, pbar=None, hashes: Optional[dict] = None, size: Optional[int] = None, priority: str = "normal"):
+    get_downloader().download(url, path, pbar, hashes, size, priority=priority)
+
+# Download Cache
+def default_cache_dir():
+    """Per-user cache directory for mrunpack (XDG on Linux/macOS, LOCALAPPDATA on Windows)"""
+    if os.name == "nt" and os.environ.get("LOCALAPPDATA"):
+        return os.path.join(os.environ["LOCALAPPDATA"], "mrunpack", "cache")
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "mrunpack")
+
+def hash_file(path: str, algorithm: str):
+    h = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def link_or_copy(src: str, dest: str):
+    """Hardlink src to dest, copying instead when the filesystem can't link"""
+    dir = os.path.dirname(dest)
+    if dir:
+        os.makedirs(dir, exist_ok=True)
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+class FileCache:
+    """Content-addressed store of downloaded files, laid out as <root>/<algorithm>/ab/cdef...
+
+    Entries are keyed on the sha512 (or sha1) from modrinth.index.json, so the
+    same jar is only ever fetched once per machine no matter which pack or
+    version asks for it. Stored files are read-only, since instances hardlink
+    them and an in-place write would change every copy; a file is still hashed
+    again before it's handed out, unless this process has checked it since it
+    last changed.
+    """
+    ALGORITHMS = ("sha512", "sha1")
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root if root is not None else default_cache_dir()
+        # Path -> (size, mtime) of files known to match their hash
+        self.checked = {}
+
+    @staticmethod
+    def key(hashes: dict):
+        for algorithm in FileCache.ALGORITHMS:
+            if hashes.get(algorithm):
+                return algorithm, hashes[algorithm].lower()
+        return None
+
+    def path_for(self, hashes: dict):
+        key = self.key(hashes)
+        if key is None:
+            return None
+        algorithm, digest = key
+        return os.path.join(self.root, algorithm, digest[:2], digest[2:])
+
+    def lookup(self, hashes: dict, size: Optional[int] = None, verify: bool = False):
+        """Return the cached path for hashes, or None if it isn't cached.
+
+        With verify, a cached file that no longer matches its hash is deleted
+        and reported as a miss.
+        """
+        path = self.path_for(hashes)
+        if path is None or not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        if size is not None and stat.st_size != size:
+            return None
+        if verify and self.checked.get(path) != (stat.st_size, stat.st_mtime_ns):
+            algorithm, digest = self.key(hashes)
+            if hash_file(path, algorithm) != digest:
+                logger.warning(f"Cached {path} was modified; downloading it again")
+                os.remove(path)
+                return None
+            self.checked[path] = (stat.st_size, stat.st_mtime_ns)
+        return path
+
+    def place(self, hashes: dict, dest: str, size: Optional[int] = None):
+        """Put the cached copy of a file at dest. Returns False on a cache miss."""
+        path = self.lookup(hashes, size, verify=True)
+        if path is None:
+            return False
+        link_or_copy(path, dest)
+        return True
+
+    def store(self, hashes: dict, src: str, verified: bool = False):
+        """Add the file at src to the cache, hashing it first unless the caller already has"""
+        key = self.key(hashes)
+        if key is None:
+            return None
+        algorithm, digest = key
+        if not verified:
+            actual = hash_file(src, algorithm)
+            if actual != digest:
+                raise IntegrityError(f"{src} has {algorithm} {actual}, expected {digest}")
+        path = self.path_for(hashes)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        link_or_copy(src, tmp)
+        if os.name != "nt":
+            # Windows won't delete or replace read-only files, which upgrades and repairs need to do
+            os.chmod(tmp, 0o444)
+        os.replace(tmp, path)
+        stat = os.stat(path)
+        self.checked[path] = (stat.st_size, stat.st_mtime_ns)
+        return path
+
+    def evict(self, hashes: dict):
+        """Delete the cached copy of a file if it no longer matches its hash. Returns True if it was deleted."""
+        key = self.key(hashes)
+        path = self.path_for(hashes)
+        if path is None or not os.path.isfile(path) or hash_file(path, key[0]) == key[1]:
+            return False
+        os.remove(path)
+        return True
+
+    def ref_path(self, instance_path: str):
+        digest = hashlib.sha1(os.path.abspath(instance_path).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.root, "refs", f"{digest}.json")
+
+    def track(self, instance_path: str, files: list):
+        """Record which cached files the instance at instance_path uses, so collect_garbage keeps them"""
+        blobs = {}
+        for entry in files:
+            key = self.key(entry.get("hashes", {}))
+            if key is not None:
+                blobs[entry["path"]] = "/".join(key)
+        path = self.ref_path(instance_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            parse.dump({"instance": os.path.abspath(instance_path), "used": time.time(), "files": blobs}, f)
+        os.replace(tmp, path)
+
+    def refs(self):
+        """Yield (reference file, reference) for every instance recorded by track"""
+        refs_dir = os.path.join(self.root, "refs")
+        names = sorted(os.listdir(refs_dir)) if os.path.isdir(refs_dir) else []
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(refs_dir, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    yield path, parse.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable cache reference {path}: {e}")
+
+    def blobs(self):
+        """Yield (key, path, os.stat_result) for every cached file; key is "<algorithm>/<digest>" as in track"""
+        for algorithm in self.ALGORITHMS:
+            base = os.path.join(self.root, algorithm)
+            prefixes = sorted(os.listdir(base)) if os.path.isdir(base) else []
+            for prefix in prefixes:
+                folder = os.path.join(base, prefix)
+                for rest in os.listdir(folder):
+                    path = os.path.join(folder, rest)
+                    if rest.endswith(".tmp") or not os.path.isfile(path):
+                        continue
+                    yield f"{algorithm}/{prefix}{rest}", path, os.stat(path)
+
+# Download Journal
+def index_fingerprint(dict_obj: dict):
+    """Stable identifier for a parsed modrinth.index.json"""
+    return hashlib.sha1(parse.dumps(dict_obj, sort_keys=True).encode("utf-8")).hexdigest()
+
+class DownloadJournal:
+    """Small JSON-lines record of an install's progress, kept next to the staging directory.
+
+    It remembers which pack the staging directory belongs to, which files have
+    been downloaded and verified, and which ones were in flight, so an
+    interrupted install can skip the former and resume the latter. The first
+    line is a snapshot and every file event after it is appended as a line of
+    its own, so recording one stays cheap however big the pack is; start()
+    folds them back into the snapshot.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.log = None
+        self.data = {"pack": None, "complete": {}, "partial": {}}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.data.update(parse.loads(f.readline() or "{}"))
+                    for line in f:
+                        try:
+                            event = parse.loads(line)
+                        except ValueError:
+                            # The last line of an interrupted run may be cut short
+                            continue
+                        self.data["partial"].pop(event["path"], None)
+                        self.data[event["state"]][event["path"]] = event["hashes"]
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Ignoring unreadable download journal {path}: {e}")
+
+    @property
+    def pack(self):
+        return self.data["pack"]
+
+    def start(self, pack: str):
+        """Begin recording for pack, forgetting anything recorded for a different one"""
+        with self.lock:
+            if self.data["pack"] != pack:
+                self.data = {"pack": pack, "complete": {}, "partial": {}}
+            self.save()
+
+    def is_complete(self, relpath: str, hashes: dict):
+        return self.data["complete"].get(relpath) == hashes
+
+    def can_resume(self, relpath: str, hashes: dict):
+        return self.data["partial"].get(relpath) == hashes
+
+    def mark_partial(self, relpath: str, hashes: dict):
+        with self.lock:
+            self.data["partial"][relpath] = hashes
+            self.append({"path": relpath, "state": "partial", "hashes": hashes})
+
+    def mark_complete(self, relpath: str, hashes: dict):
+        with self.lock:
+            self.data["partial"].pop(relpath, None)
+            self.data["complete"][relpath] = hashes
+            self.append({"path": relpath, "state": "complete", "hashes": hashes})
+
+    def append(self, event: dict):
+        if self.log is None:
+            self.log = open(self.path, 'a', encoding='utf-8')
+        self.log.write(parse.dumps(event) + "\n")
+        self.log.flush()
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+    def save(self):
+        """Rewrite the journal as a single snapshot line"""
+        self.close()
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(parse.dumps(self.data) + "\n")
+        os.replace(tmp, self.path)
+
+    def remove(self):
+        with self.lock:
+            self.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+# Download Progress
+class Progress:
+    """Byte and file counts for everything being downloaded, shared by all workers.
+
+    Workers call update() for every chunk, which only appends to a queue; a
+    background thread adds those up and redraws the bar and the JSON lines
+    stream every `interval` seconds, so thousands of small files across many
+    threads neither fight over a lock nor spam the terminal. Totals can grow
+    while it runs, so one Progress can cover several packs. Every line on
+    `stream` is a JSON object with an "event" of "progress", "file" or "done".
+    """
+    def __init__(self, desc: str = "Downloading files", bar: bool = True, stream=None, interval: float = 0.25):
+        self.lock = threading.Lock()
+        self.interval = interval
+        self.stream = stream
+        self.pending = deque()
+        self.bytes = self.total_bytes = 0
+        self.files = self.total_files = self.failed = 0
+        self.started = time.monotonic()
+        self.shown = 0
+        self.bar = tqdm(total=0, unit='B', unit_scale=True, desc=desc, mininterval=0) if bar else None
+        self.stopped = threading.Event()
+        self.ticker = threading.Thread(target=self.tick, name="progress", daemon=True)
+        self.ticker.start()
+
+    def add_total(self, nbytes: int, files: int = 0):
+        with self.lock:
+            self.total_bytes += nbytes
+            self.total_files += files
+
+    def update(self, nbytes: int):
+        # deque.append is atomic, so the hot path needs no lock
+        self.pending.append(nbytes)
+
+    def file_done(self, path: str, error: Optional[Exception] = None):
+        with self.lock:
+            if error is None:
+                self.files += 1
+            else:
+                self.failed += 1
+            event = {"event": "file", "path": path, "ok": error is None}
+            if error is not None:
+                event["error"] = str(error)
+            self.emit(event)
+
+    def state(self):
+        elapsed = time.monotonic() - self.started
+        return {"elapsed": round(elapsed, 3), "bytes": self.bytes, "total_bytes": self.total_bytes, "files": self.files,
+                "total_files": self.total_files, "failed": self.failed, "rate": round(self.bytes / elapsed) if elapsed else 0}
+
+    def emit(self, event: dict):
+        if self.stream is None:
+            return
+        try:
+            self.stream.write(parse.dumps(event) + "\n")
+            self.stream.flush()
+        except (OSError, ValueError) as e:
+            # A GUI that stopped reading shouldn't take the install down with it
+            logger.warning(f"Stopped writing progress events: {e}")
+            self.stream = None
+
+    def render(self):
+        with self.lock:
+            while self.pending:
+                self.bytes += self.pending.popleft()
+            if self.bar is not None:
+                self.bar.total = self.total_bytes
+                self.bar.set_postfix_str(f"{self.files}/{self.total_files} files", refresh=False)
+                self.bar.update(self.bytes - self.shown)
+                self.shown = self.bytes
+            self.emit({"event": "progress", **self.state()})
+
+    def tick(self):
+        while not self.stopped.wait(self.interval):
+            self.render()
+
+    def close(self):
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        self.ticker.join()
+        self.render()
+        with self.lock:
+            self.emit({"event": "done", **self.state()})
+            if self.bar is not None:
+                self.bar.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Concurrent Downloader
+class DownloadScheduler:
+    """Download machinery shared by every pack installed in one process.
+
+    It holds the HTTP session with its per-host limits, the worker pool, and
+    the cache. It also tracks which files are being fetched, so a jar that
+    several packs (or paths) need is downloaded once and copied for the rest.
+    """
+    def __init__(self, jobs: int = 8, downloader: Optional[Downloader] = None, cache: Optional[FileCache] = None):
+        self.downloader = downloader if downloader is not None else Downloader(pool_size=jobs)
+        self.cache = cache
+        self.pool = ThreadPoolExecutor(max_workers=max(1, jobs))
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.finished = {}
+
+    def claim(self, key):
+        """Wait until nobody else is fetching key. Returns the path of a finished copy,
+        or None if the caller should fetch it (and must then call finish)."""
+        while True:
+            with self.lock:
+                path = self.finished.get(key)
+                if path is not None and os.path.exists(path):
+                    return path
+                event = self.inflight.get(key)
+                if event is None:
+                    self.inflight[key] = threading.Event()
+                    return None
+            event.wait()
+
+    def finish(self, key, path: Optional[str]):
+        """Hand the result of a claim to everyone waiting on key; path is None if the fetch failed"""
+        with self.lock:
+            if path is not None:
+                self.finished[key] = path
+            self.inflight.pop(key).set()
+
+    def close(self, cancel_futures: bool = False):
+        """Stop the workers; cancel_futures drops queued downloads instead of waiting for them"""
+        self.pool.shutdown(cancel_futures=cancel_futures)
+
+SMALL_FILE = 256 * 1024
+def file_priority(entry: dict):
+    """Bandwidth class for a manifest entry: small files first, as they finish quickly"""
+    return "high" if entry.get("fileSize", SMALL_FILE + 1) <= SMALL_FILE else "normal"
+
+def download_files(files: list, dest_dir: str, jobs: int = 8, per_host: int = 4, downloader: Optional[Downloader] = None,
+                   cache: Optional[FileCache] = None, journal: Optional[DownloadJournal] = None,
+                   scheduler: Optional[DownloadScheduler] = None, metrics: Optional[Metrics] = None,
+                   progress: Optional[Progress] = None, cancel: Optional[threading.Event] = None,
+                   priority: Optional[str] = None):
+    """Download every entry of a modrinth.index.json "files" list into dest_dir.
+
+    Returns a list of (entry, exception) for every file that failed; the rest
+    keep downloading. Files the cache holds are linked instead of fetched, and
+    ones the journal lists as complete are skipped. A scheduler shares its
+    workers, downloader and cache with other calls, e.g. other packs. Without
+    a `priority`, small files go first under a bandwidth cap.
+
+    Setting `cancel` (or a KeyboardInterrupt, which is raised again) stops
+    the transfers in flight and drops the queued ones, leaving the journal
+    and .part files for a resume.
+    """
+    cancel = cancel if cancel is not None else threading.Event()
+    own_scheduler = scheduler is None
+    if own_scheduler:
+        if downloader is None:
+            downloader = Downloader(pool_size=max(jobs, per_host), per_host=per_host)
+        scheduler = DownloadScheduler(jobs, downloader, cache)
+    downloader, cache = scheduler.downloader, scheduler.cache
+    record = metrics.file if metrics is not None else lambda *args, **fields: None
+
+    def fetch(entry):
+        if cancel.is_set():
+            raise DownloadCancelled(f"Download of {entry['path']} was cancelled")
+        dest = instance_file(dest_dir, entry["path"])
+        if dest is None:
+            raise DownloadError(f"{entry['path']} points outside {dest_dir}")
+        hashes = entry.get("hashes", {})
+        started = time.monotonic()
+        if journal is not None and journal.is_complete(entry["path"], hashes) and os.path.exists(dest):
+            progress.update(entry.get("fileSize", 0))
+            record(entry["path"], "journal", entry.get("fileSize", 0))
+            return
+        if cache is not None and cache.place(hashes, dest, entry.get("fileSize")):
+            progress.update(entry.get("fileSize", 0))
+            record(entry["path"], "cache", entry.get("fileSize", 0), seconds=time.monotonic() - started)
+        else:
+            key = FileCache.key(hashes)
+            finished = scheduler.claim(key) if key is not None else None
+            if finished is not None:
+                # Someone else in this process just fetched the same file
+                link_or_copy(finished, dest)
+                progress.update(entry.get("fileSize", 0))
+                record(entry["path"], "shared", entry.get("fileSize", 0), seconds=time.monotonic() - started)
+            else:
+                try:
+                    if journal is not None and not journal.can_resume(entry["path"], hashes):
+                        # Any .part file left here belongs to some other version of the file
+                        if os.path.exists(dest + ".part"):
+                            os.remove(dest + ".part")
+                        journal.mark_partial(entry["path"], hashes)
+                    stats = downloader.download(entry["downloads"], dest, progress, hashes, entry.get("fileSize"), resume=journal is not None, cancel=cancel,
+                                                priority=file_priority(entry) if priority is None else priority)
+                    record(entry["path"], "network", entry.get("fileSize", 0), **stats)
+                    if cache is not None:
+                        try:
+                            cache.store(hashes, dest, verified=True)
+                        except OSError as e:
+                            logger.warning(f"Couldn't add {entry['path']} to the download cache: {e}")
+                except BaseException:
+                    if key is not None:
+                        scheduler.finish(key, None)
+                    raise
+                if key is not None:
+                    scheduler.finish(key, dest)
+        if journal is not None:
+            journal.mark_complete(entry["path"], hashes)
+
+    failures = []
+    # Start the biggest files first so they don't end up as the long tail
+    files = sorted(files, key=lambda entry: entry.get("fileSize", 0), reverse=True)
+    own_progress = progress is None
+    if own_progress:
+        progress = Progress()
+    progress.add_total(sum(entry.get("fileSize", 0) for entry in files), len(files))
+    futures = {}
+    try:
+        futures = {scheduler.pool.submit(fetch, entry): entry for entry in files}
+        for future in as_completed(futures):
+            entry = futures[future]
+            try:
+                future.result()
+                progress.file_done(entry["path"])
+            except (DownloadCancelled, CancelledError) as e:
+                # Don't start the files still queued; a shared scheduler keeps running other calls' work
+                for queued in futures:
+                    queued.cancel()
+                if isinstance(e, CancelledError):
+                    e = DownloadCancelled(f"Download of {entry['path']} was cancelled")
+                progress.file_done(entry["path"], e)
+                failures.append((entry, e))
+            except Exception as e:
+                logger.critical(f"Unable to download {entry['path']}: {e}")
+                record(entry["path"], "failed", entry.get("fileSize", 0), error=str(e))
+                progress.file_done(entry["path"], e)
+                failures.append((entry, e))
+    except KeyboardInterrupt:
+        cancel.set()
+        for queued in futures:
+            queued.cancel()
+        raise
+    finally:
+        if own_progress:
+            progress.close()
+        if own_scheduler:
+            scheduler.close(cancel_futures=cancel.is_set())
+    return failures
+
+def find_packs(paths: list):
+    """Expand .mrpack paths, directories of packs and glob patterns into a list of pack files"""
+    packs = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = sorted(glob.glob(os.path.join(path, "*.mrpack")))
+        elif glob.has_magic(path):
+            matches = sorted(glob.glob(path))
+        else:
+            matches = [path]
+        for match in matches:
+            if match not in packs:
+                packs.append(match)
+    return packs
+
+def pack_workspace(mrpack_path: str, root: str = ".mrunpack-work"):
+    """Private working directory for one pack, so several can install side by side"""
+    stem = os.path.splitext(os.path.basename(mrpack_path))[0]
+    digest = hashlib.sha1(os.path.abspath(mrpack_path).encode("utf-8")).hexdigest()[:8]
+    return os.path.join(root, f"{stem}-{digest}")
+
+# Install Planning
+def free_space(path: str):
+    """Free bytes on the filesystem path is (or will be) on"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return shutil.disk_usage(path).free
+
+def same_filesystem(a: str, b: str):
+    def device(path):
+        path = os.path.abspath(path)
+        while not os.path.exists(path):
+            path = os.path.dirname(path)
+        return os.stat(path).st_dev
+    return device(a) == device(b)
+
+def instance_file(instance_path: str, relpath: str):
+    """Absolute path of a pack's relpath inside instance_path, or None if it points outside it"""
+    root = os.path.abspath(instance_path)
+    target = os.path.abspath(os.path.join(root, relpath))
+    if target == root or os.path.commonpath([root, target]) != root:
+        return None
+    return target
+
+def dedupe_paths(files: list):
+    """Drop entries whose path an earlier entry already claimed. Returns (files, duplicate paths).
+
+    Entries pointing outside the instance (absolute paths or ones using ..) are dropped too.
+    """
+    seen = {}
+    unique, duplicates = [], []
+    for entry in files:
+        if instance_file(os.curdir, entry["path"]) is None:
+            logger.warning(f"Skipping {entry['path']}: it points outside the instance")
+            continue
+        previous = seen.get(entry["path"])
+        if previous is not None:
+            if previous.get("hashes") != entry.get("hashes"):
+                logger.warning(f"{entry['path']} is listed more than once with different contents; keeping the first")
+            duplicates.append(entry["path"])
+            continue
+        seen[entry["path"]] = entry
+        unique.append(entry)
+    return unique, duplicates
+
+def plan_downloads(files: list, dest_dir: str, cache: Optional[FileCache] = None, journal: Optional[DownloadJournal] = None):
+    """Work out what download_files(files, dest_dir, ...) will do, without any network I/O.
+
+    Every entry ends up in one of: "present" (the journal has it done in
+    dest_dir already), "cached", "shared" (same content as another entry, so
+    only one of them is fetched) or "download", which is ordered largest
+    first like download_files works. Duplicate paths are listed and dropped.
+    "disk" compares the bytes that will be written to dest_dir's filesystem
+    against the free space there.
+    """
+    files, duplicates = dedupe_paths(files)
+    groups = {"present": [], "cached": [], "shared": [], "download": []}
+    fetching = set()
+    for entry in files:
+        hashes = entry.get("hashes", {})
+        if journal is not None and journal.is_complete(entry["path"], hashes) and os.path.exists(os.path.join(dest_dir, entry["path"])):
+            groups["present"].append(entry)
+        elif cache is not None and cache.lookup(hashes, entry.get("fileSize")) is not None:
+            groups["cached"].append(entry)
+        elif FileCache.key(hashes) is not None and FileCache.key(hashes) in fetching:
+            groups["shared"].append(entry)
+        else:
+            fetching.add(FileCache.key(hashes))
+            groups["download"].append(entry)
+    groups["download"].sort(key=lambda entry: entry.get("fileSize", 0), reverse=True)
+
+    def total(entries):
+        return sum(entry.get("fileSize", 0) for entry in entries)
+    # Cached and shared files are hardlinked when they can be, which takes no space
+    needed = total(groups["download"])
+    if cache is not None and not same_filesystem(cache.root, dest_dir):
+        needed += total(groups["cached"])
+    free = free_space(dest_dir)
+    plan = {"files": len(files), "bytes": total(files), "duplicates": duplicates}
+    for name, entries in groups.items():
+        plan[name] = {"files": len(entries), "bytes": total(entries), "paths": [entry["path"] for entry in entries]}
+    plan["disk"] = {"path": os.path.abspath(dest_dir), "free": free, "needed": needed, "fits": needed <= free}
+    return plan
+
+# Instance Placement
+LINK_MODES = ("move", "hardlink", "reflink", "copy")
+FICLONE = 0x40049409
+def clone_file(src: str, dest: str):
+    """Copy-on-write clone src to dest (btrfs, XFS, bcachefs). Raises OSError where unsupported."""
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(src, 'rb') as s, open(dest, 'wb') as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+def place_file(src: str, dest: str, mode: str = "hardlink"):
+    """Put src at dest by hardlink or reflink, falling back to a normal copy"""
+    try:
+        if mode == "hardlink":
+            os.link(src, dest)
+            return dest
+        if mode == "reflink":
+            clone_file(src, dest)
+            return dest
+    except OSError as e:
+        logger.info(f"Couldn't {mode} {src}, copying instead: {e}")
+        if os.path.lexists(dest):
+            os.remove(dest)
+    return shutil.copy2(src, dest)
+
+def place_tree(src_dir: str, dest_dir: str, mode: str = "move"):
+    """Replace dest_dir with the contents of src_dir.
+
+    "move" renames the directory (copying only if it's on another filesystem),
+    "hardlink" and "reflink" share data with src_dir where the filesystem
+    allows it, and "copy" always writes a full copy.
+    """
+    if mode not in LINK_MODES:
+        raise ValueError(f"Unknown link mode {mode!r}, expected one of {', '.join(LINK_MODES)}")
+    if os.path.exists(dest_dir):
+        shutil.rmtree(dest_dir)
+    parent = os.path.dirname(os.path.abspath(dest_dir))
+    os.makedirs(parent, exist_ok=True)
+    if mode == "move":
+        shutil.move(src_dir, dest_dir)
+    elif mode == "copy":
+        shutil.copytree(src_dir, dest_dir)
+    else:
+        shutil.copytree(src_dir, dest_dir, copy_function=lambda src, dest: place_file(src, dest, mode))
+    return dest_dir
+
+# Task Pipeline
+class Pipeline:
+    """Runs named tasks on a thread pool, each one as soon as the tasks it depends on are done.
+
+    A task listed in `deps` must succeed first; if it fails, the dependent task
+    is skipped. A task listed in `after` only has to finish, whatever the outcome
+    (or not have been added at all). With metrics, every task is recorded as a
+    span named after it, carrying the given labels.
+    """
+    def __init__(self, max_workers: int = 4, metrics: Optional[Metrics] = None, labels: Optional[dict] = None):
+        self.max_workers = max_workers
+        self.metrics = metrics
+        self.labels = labels or {}
+        self.tasks = {}
+        # Filled in as tasks finish, so a task can read what its dependencies returned
+        self.results = {}
+
+    def add(self, name: str, fn, deps=(), after=()):
+        self.tasks[name] = (fn, tuple(deps), tuple(after))
+
+    def call(self, name: str, fn):
+        if self.metrics is None:
+            return fn()
+        with self.metrics.span(name, **self.labels):
+            return fn()
+
+    def run(self):
+        """Run every task. Returns (results, errors, skipped): results and errors are keyed by task name."""
+        results, errors, skipped = self.results, {}, []
+        pending = dict(self.tasks)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                progressed = True
+                while progressed:
+                    progressed = False
+                    for name, (fn, deps, after) in list(pending.items()):
+                        failed = [dep for dep in deps if dep in errors or dep in skipped]
+                        if failed:
+                            logger.warning(f"Skipping {name} because {', '.join(failed)} failed")
+                            skipped.append(name)
+                            del pending[name]
+                            progressed = True
+                        elif all(dep in results for dep in deps) and all(
+                                task not in self.tasks or task in results or task in errors or task in skipped
+                                for task in after):
+                            running[pool.submit(self.call, name, fn)] = name
+                            del pending[name]
+                if not running:
+                    # Whatever is left waits on tasks that were never added
+                    skipped.extend(pending)
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        logger.error(f"{name} failed: {e}")
+                        errors[name] = e
+        return results, errors, skipped
 
 # Zip File Processor
 
@@ -38,7 +1320,6 @@ def mrpack2zip(filepath: str):
     newfilename = root + '.zip'
     shutil.copyfile(filepath, newfilename)
     return newfilename
-import zipfile
 def extractzip(zippath: str):
     try:
         with zipfile.ZipFile(zippath, mode="r") as zip_file:
@@ -50,6 +1331,337 @@ def extractzip(zippath: str):
     except Exception as e:
         print(f"Something went wrong!: {e}")
         pass
+def read_index(mrpack_path: str):
+    """Read modrinth.index.json straight out of a .mrpack without extracting anything"""
+    with zipfile.ZipFile(mrpack_path, mode="r") as zip_file:
+        dict_obj = jsonparse(zip_file.read("modrinth.index.json").decode("utf-8"))
+    if not isinstance(dict_obj, dict):
+        dict_obj = dict(dict_obj)
+    return dict_obj
+
+SIDES = ("client", "server")
+def select_files(files: list, side: str = "client", optional: bool = True,
+                 include: Optional[list] = None, exclude: Optional[list] = None):
+    """Pick the manifest entries that belong in a `side` install, using each entry's env field.
+
+    Files unsupported on that side are dropped and required ones always kept.
+    Optional files are kept when `optional` is set, minus any path matching an
+    `exclude` glob; a path matching an `include` glob is kept regardless.
+    """
+    if side not in SIDES:
+        raise ValueError(f"Unknown side {side!r}, expected one of {', '.join(SIDES)}")
+    def matches(path, patterns):
+        return any(fnmatch.fnmatch(path, pattern) for pattern in patterns or ())
+    selected = []
+    for entry in files:
+        support = entry.get("env", {}).get(side, "required")
+        if support == "unsupported":
+            continue
+        if support == "optional" and not matches(entry["path"], include):
+            if not optional or matches(entry["path"], exclude):
+                continue
+        selected.append(entry)
+    return selected
+
+def override_entries(zip_file: zipfile.ZipFile, side: str = "client"):
+    """Map each override's path inside the instance to its ZipInfo; <side>-overrides/ wins over overrides/"""
+    entries = {}
+    for prefix in ("overrides/", f"{side}-overrides/"):
+        for member in zip_file.infolist():
+            if member.filename.startswith(prefix) and not member.is_dir():
+                entries[member.filename[len(prefix):]] = member
+    return entries
+
+def extract_overrides(mrpack_path: str, dest_dir: str, side: str = "client", skip: Optional[set] = None):
+    """Stream the overrides/ and <side>-overrides/ folders of a .mrpack into dest_dir.
+
+    Entries are copied from the archive directly to their final location;
+    side-specific overrides win over the common ones. Paths in `skip` are left
+    alone. Returns {relative path: CRC-32} for every override in the pack, which
+    is what the install record keeps to spot user edits later.
+    """
+    overrides = {}
+    os.makedirs(dest_dir, exist_ok=True)
+    with zipfile.ZipFile(mrpack_path, mode="r") as zip_file:
+        for relpath, member in override_entries(zip_file, side).items():
+            target = instance_file(dest_dir, relpath)
+            if target is None:
+                logger.warning(f"Skipping {member.filename}: it points outside the instance")
+                continue
+            overrides[relpath] = member.CRC
+            if skip and relpath in skip:
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with zip_file.open(member) as src, open(target, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+    return overrides
+
+# Install Records and Upgrades
+INSTALL_RECORD = ".mrunpack.json"
+def read_install_record(instance_path: str):
+    """Load what mrunpack last installed into instance_path, or None if it has no record"""
+    record_path = os.path.join(instance_path, INSTALL_RECORD)
+    if not os.path.exists(record_path):
+        return None
+    with open(record_path, 'r', encoding='utf-8') as f:
+        return parse.load(f)
+
+def write_install_record(instance_path: str, dict_obj: dict, files: list, overrides: dict, side: str = "client"):
+    """Remember the manifest and overrides that were installed, for --upgrade"""
+    index = {key: value for key, value in dict_obj.items() if key != "files"}
+    index["files"] = files
+    record = {"side": side, "index": index, "overrides": overrides}
+    record_path = os.path.join(instance_path, INSTALL_RECORD)
+    with open(record_path + ".tmp", 'w', encoding='utf-8') as f:
+        parse.dump(record, f, indent=2)
+    os.replace(record_path + ".tmp", record_path)
+
+def file_crc32(path: str):
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+def diff_manifests(old_files: list, new_files: list, instance_path: Optional[str] = None):
+    """Compare two "files" lists by path and sha512.
+
+    Returns a dict of entry lists: "added", "changed" and "unchanged" from the
+    new manifest and "removed" from the old one. With instance_path, unchanged
+    files missing from disk are reported as changed so they get fetched again.
+    """
+    old = {entry["path"]: entry for entry in old_files}
+    plan = {"added": [], "changed": [], "removed": [], "unchanged": []}
+    for entry in new_files:
+        previous = old.get(entry["path"])
+        if previous is None:
+            plan["added"].append(entry)
+        elif previous.get("hashes", {}).get("sha512") != entry.get("hashes", {}).get("sha512"):
+            plan["changed"].append(entry)
+        elif instance_path is not None and not os.path.exists(os.path.join(instance_path, entry["path"])):
+            plan["changed"].append(entry)
+        else:
+            plan["unchanged"].append(entry)
+    new_paths = {entry["path"] for entry in new_files}
+    plan["removed"] = [entry for path, entry in old.items() if path not in new_paths]
+    return plan
+
+def upgrade_overrides(mrpack_path: str, instance_path: str, previous: dict, side: str = "client"):
+    """Apply a new pack's overrides over an installed instance without clobbering user edits.
+
+    An override is only rewritten when the pack changed it and the copy on disk
+    still matches what was installed last time; overrides dropped from the pack
+    are deleted under the same condition. Returns the new {path: CRC-32} map.
+    """
+    with zipfile.ZipFile(mrpack_path, mode="r") as zip_file:
+        entries = override_entries(zip_file, side)
+    skip = set()
+    for relpath, member in entries.items():
+        target = instance_file(instance_path, relpath)
+        if target is None or not os.path.exists(target):
+            continue
+        if previous.get(relpath) == member.CRC:
+            skip.add(relpath)
+        elif file_crc32(target) not in (previous.get(relpath), member.CRC):
+            print(f"Keeping your changes to {relpath}")
+            skip.add(relpath)
+    for relpath, crc in previous.items():
+        target = instance_file(instance_path, relpath)
+        if relpath not in entries and target is not None and os.path.exists(target):
+            if file_crc32(target) == crc:
+                os.remove(target)
+            else:
+                print(f"Keeping {relpath}: the pack no longer ships it, but you changed it")
+    return extract_overrides(mrpack_path, instance_path, side, skip)
+
+# Cache Garbage Collection
+def relink_instance(cache: FileCache, ref: dict, dryrun: bool = False):
+    """Swap an instance's own copies of cached files for hardlinks to the cache. Returns the bytes saved."""
+    saved = 0
+    for relpath, blob in ref.get("files", {}).items():
+        algorithm, digest = blob.split("/", 1)
+        path = os.path.join(ref["instance"], relpath)
+        stored = cache.path_for({algorithm: digest})
+        try:
+            current, cached = os.stat(path), os.stat(stored)
+        except OSError:
+            continue
+        if current.st_ino == cached.st_ino or current.st_dev != cached.st_dev or current.st_size != cached.st_size:
+            continue
+        if hash_file(path, algorithm) != digest:
+            # Changed since it was installed; that copy is the user's now
+            continue
+        if not dryrun:
+            tmp = f"{path}.{os.getpid()}.tmp"
+            try:
+                os.link(stored, tmp)
+                os.replace(tmp, path)
+            except OSError as e:
+                logger.warning(f"Couldn't link {path} to the download cache: {e}")
+                if os.path.lexists(tmp):
+                    os.remove(tmp)
+                continue
+        saved += current.st_size
+    return saved
+
+def collect_garbage(cache: FileCache, max_size: Optional[int] = None, grace: float = 3600, relink: bool = False,
+                    dryrun: bool = False):
+    """Trim the download cache that installed instances hardlink into.
+
+    References from instances that no longer exist are dropped first. Without
+    max_size, every cached file no instance references is then deleted; with
+    it, files are deleted until those only the cache holds fit in max_size
+    bytes, unreferenced ones before referenced ones and the least recently used
+    first within each. Files an instance hardlinks to are kept either way:
+    deleting them frees no disk and only undoes the sharing.
+    Files stored or used in the last `grace` seconds are kept, as an install
+    may be about to link them. With relink, instances' own copies of cached
+    files are first swapped for hardlinks.
+
+    Returns counts of what was done (or, with dryrun, would be): instances
+    still referencing the cache, pruned references, bytes relinked, files
+    removed, bytes freed, and the files and bytes left in the cache.
+    """
+    now = time.time()
+    last_used = {}
+    report = {"instances": 0, "pruned": [], "relinked": 0, "removed": 0, "freed": 0, "files": 0, "size": 0}
+    for ref_path, ref in list(cache.refs()):
+        if not os.path.isfile(os.path.join(ref.get("instance", ""), INSTALL_RECORD)):
+            report["pruned"].append(ref.get("instance"))
+            if not dryrun:
+                os.remove(ref_path)
+            continue
+        report["instances"] += 1
+        if relink:
+            report["relinked"] += relink_instance(cache, ref, dryrun)
+        for blob in ref.get("files", {}).values():
+            last_used[blob] = max(last_used.get(blob, 0), ref.get("used", 0))
+
+    blobs = list(cache.blobs())
+    size = sum(stat.st_size for _, _, stat in blobs)
+    # Space the cache alone holds; that's all a deletion can give back
+    unshared = sum(stat.st_size for _, _, stat in blobs if stat.st_nlink == 1)
+    # Unreferenced files go first, then the ones whose instances were installed longest ago
+    blobs.sort(key=lambda blob: (blob[0] in last_used, last_used.get(blob[0], blob[2].st_mtime)))
+    for key, path, stat in blobs:
+        if max_size is not None:
+            evict = unshared > max_size and stat.st_nlink == 1
+        else:
+            evict = key not in last_used
+        if not evict or now - max(stat.st_mtime, last_used.get(key, 0)) < grace:
+            continue
+        if not dryrun:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Couldn't remove {path} from the download cache: {e}")
+                continue
+        size -= stat.st_size
+        report["removed"] += 1
+        if stat.st_nlink == 1:
+            # Otherwise an instance still links to it, so no disk space comes back
+            unshared -= stat.st_size
+            report["freed"] += stat.st_size
+    report["files"] = len(blobs) - report["removed"]
+    report["size"] = size
+    return report
+
+# Instance Verification
+VERIFY_ALGORITHMS = ("sha512", "sha1")
+
+def verify_file(job: tuple):
+    """Check one file against its manifest hashes. job is (path, hashes, size) so it can cross
+    a process boundary; returns "ok", "missing", "size" or "corrupt"."""
+    path, hashes, size = job
+    try:
+        actual_size = os.path.getsize(path)
+    except OSError:
+        return "missing"
+    if size is not None and actual_size != size:
+        return "size"
+    algorithm = next((algorithm for algorithm in VERIFY_ALGORITHMS if hashes.get(algorithm)), None)
+    if algorithm is None:
+        return "ok"
+    h = hashlib.new(algorithm)
+    if actual_size:
+        # Hash straight from the page cache instead of copying the file through read() buffers
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            h.update(data)
+    return "ok" if h.hexdigest() == hashes[algorithm].lower() else "corrupt"
+
+def verify_instance(files: list, instance_path: str, workers: Optional[int] = None, known: Optional[set] = None,
+                    pool=None):
+    """Hash every manifest file in instance_path across a process pool, or on `pool` if one is given.
+
+    Returns a dict of path lists: "ok", "missing", "corrupt" (wrong size or
+    hash) and "extra", which holds files in the same top-level folders as the
+    manifest's (mods/, resourcepacks/, ...) that the manifest doesn't list and
+    that aren't in `known`, e.g. the pack's overrides.
+    """
+    report = {"ok": [], "missing": [], "corrupt": [], "extra": []}
+    # Biggest first, so one large file doesn't start last and hold up the pool
+    files = sorted(files, key=lambda entry: entry.get("fileSize", 0), reverse=True)
+    jobs = [(os.path.join(instance_path, entry["path"]), entry.get("hashes", {}), entry.get("fileSize")) for entry in files]
+    workers = workers or os.cpu_count() or 1
+    if jobs:
+        own_pool = pool is None
+        if own_pool:
+            pool = ProcessPoolExecutor(max_workers=min(workers, len(jobs)))
+        try:
+            for entry, status in zip(files, pool.map(verify_file, jobs, chunksize=max(1, len(jobs) // (workers * 4)))):
+                report["corrupt" if status == "size" else status].append(entry["path"])
+        finally:
+            if own_pool:
+                pool.shutdown()
+
+    listed = {os.path.normpath(entry["path"]) for entry in files} | {os.path.normpath(path) for path in (known or ())}
+    folders = {os.path.normpath(entry["path"]).split(os.sep)[0] for entry in files if os.sep in os.path.normpath(entry["path"])}
+    for folder in sorted(folders):
+        for root, dirs, names in os.walk(os.path.join(instance_path, folder)):
+            for name in names:
+                relpath = os.path.relpath(os.path.join(root, name), instance_path)
+                if relpath not in listed and not name.endswith(".part"):
+                    report["extra"].append(relpath.replace(os.sep, "/"))
+    return report
+
+def expected_files(dict_obj: dict, instance_path: str, side: Optional[str] = None, optional: bool = True,
+                   include: Optional[list] = None, exclude: Optional[list] = None):
+    """Work out from its install record which manifest entries an instance should have.
+
+    Optional files the install left out aren't expected, and paths the record
+    lists (overrides included) come back as known so verify_instance doesn't
+    report them as extra. side defaults to the one the instance was installed
+    for. Returns (files, known, side).
+    """
+    record = read_install_record(instance_path)
+    if side is None:
+        side = record.get("side", "client") if record is not None else "client"
+    files, _ = dedupe_paths(select_files(dict_obj.get("files", []), side, optional, include, exclude))
+    known = set()
+    if record is not None:
+        installed = {entry["path"] for entry in record["index"].get("files", [])}
+        files = [entry for entry in files if entry["path"] in installed or entry.get("env", {}).get(side) != "optional"]
+        known = set(record.get("overrides", {})) | installed
+    return files, known, side
+
+def repair_files(files: list, report: dict, instance_path: str, scheduler: DownloadScheduler,
+                 metrics: Optional[Metrics] = None, progress: Optional[Progress] = None):
+    """Download again whatever a verify_instance report lists as missing or corrupt.
+
+    Adds the "repaired" and "failed" paths to the report and returns it.
+    """
+    bad = set(report["missing"]) | set(report["corrupt"])
+    entries = [entry for entry in files if entry["path"] in bad]
+    if scheduler.cache is not None:
+        for entry in entries:
+            # A corrupt file may be a hardlink to the cached copy, which then needs to go too
+            scheduler.cache.evict(entry.get("hashes", {}))
+    failures = download_files(entries, instance_path, scheduler=scheduler, metrics=metrics, progress=progress)
+    report["failed"] = [entry["path"] for entry, _ in failures]
+    report["repaired"] = [entry["path"] for entry in entries if entry["path"] not in report["failed"]]
+    return report
+
+# Modloader
 def check_modloader(deps: dict):
     result = {
         'type': 'unknown',
@@ -69,31 +1681,175 @@ def check_modloader(deps: dict):
         result['type'] = 'neoforge'
         result['version'] = deps.get('neoforge')
     return result
-# Import for download_modloader
-import pathlib
-import subprocess
-def download_modloader(meta: dict, dotminecraftpath: str):
-    if dotminecraftpath == "" or None: raise ValueError("installpath not provided")
-    modLoaderJarPath = None
+def modloader_version_id(modloader: dict):
+    """Version name the launcher should start for a check_modloader result (format varies by type)"""
+    if modloader['type'] == 'fabric':
+        return f"fabric-loader-{modloader['version']}-{modloader['minecraft']}"
+    elif modloader['type'] == 'forge':
+        # The Forge installer names its version <minecraft>-forge-<version>
+        return f"{modloader['minecraft']}-forge-{modloader['version']}"
+    elif modloader['type'] == 'quilt':
+        return f"quilt-loader-{modloader['version']}-{modloader['minecraft']}"
+    elif modloader['type'] == 'neoforge':
+        return f"neoforge-{modloader['version']}"
+    return modloader['minecraft']  # Fallback to vanilla
+
+def minecraft_dir_path(minecraft_dir: str = "Default"):
+    """Resolve "Default" to the OS's usual .minecraft location"""
+    if minecraft_dir != "Default":
+        return minecraft_dir
+    if os.name == "nt":
+        return os.path.expandvars(r"%APPDATA%\.minecraft")
+    elif os.name == "posix":
+        return os.path.expanduser("~/.minecraft")
+    logger.warning("Unknown OS, using current directory for .minecraft")
+    return os.path.abspath(".minecraft")
+
+def pack_defaults(dict_obj: dict, mrpack_path: str):
+    """The profile name, version and directories an install of this pack uses unless told otherwise"""
+    default_minecraft = minecraft_dir_path("Default")
+    profile_name = dict_obj.get("name", os.path.splitext(os.path.basename(mrpack_path))[0])
+    return {
+        "profile_name": profile_name,
+        "version_id": dict_obj.get("versionId", "1.0.0"),
+        "minecraft_dir": default_minecraft,
+        "profile_dir": os.path.join(default_minecraft, profile_name)
+    }
+MODLOADER_NAMES = {'fabric': 'Fabric', 'forge': 'Forge', 'quilt': 'Quilt', 'neoforge': 'NeoForge'}
+def modloader_installer_url(meta: dict):
+    """Where to get the installer jar for a check_modloader result, or None if there's nothing to install"""
     if meta['type'] == 'fabric':
-        print("Fabric is not currently supported! Skipping modloader installation.")
-        download("https://maven.fabricmc.net/net/fabricmc/fabric-installer/1.1.0/fabric-installer-1.1.0.jar", ".tmp/fabric_installer.jar", )
-        try: 
-            subprocess.run(f"java -jar .tmp/fabric_installer.jar client -mcversion {meta['minecraft']} -loader {meta['version']} -dir {dotminecraftpath}")
-        except Exception as e:
-            return e
+        return "https://maven.fabricmc.net/net/fabricmc/fabric-installer/1.1.0/fabric-installer-1.1.0.jar"
     elif meta['type'] == 'forge':
-        print("Forge is not currently supported! Skipping modloader installation.")
-    elif meta['type'] == 'quilt-loader':
-        print("Quilt loader is not currently supported! Skipping modloader installation.")
+        return f"https://maven.minecraftforge.net/net/minecraftforge/forge/{meta['minecraft']}-{meta['version']}/forge-{meta['minecraft']}-{meta['version']}-installer.jar"
+    elif meta['type'] == 'quilt':
+        return "https://maven.quiltmc.org/repository/release/org/quiltmc/quilt-installer/1.0.0/quilt-installer-1.0.0.jar"
     elif meta['type'] == 'neoforge':
-        print("Neoforge is not currently supported! Skipping modloader installation.")
+        return f"https://maven.neoforged.net/releases/net/neoforged/neoforge/{meta['version']}/neoforge-{meta['version']}-installer.jar"
+    return None
+
+def modloader_installer_args(meta: dict, dotminecraftpath: str):
+    """Command-line arguments that make the installer jar install into dotminecraftpath"""
+    if meta['type'] == 'fabric':
+        return ["client", "-mcversion", meta['minecraft'], "-loader", meta['version'], "-dir", dotminecraftpath]
+    elif meta['type'] == 'quilt':
+        return ["install", "client", meta['minecraft'], meta['version'], f"--install-dir={dotminecraftpath}"]
+    return ["--installClient", "--installDir", dotminecraftpath]
+
+def installer_cache_dir(cache_dir: Optional[str] = None):
+    return os.path.join(cache_dir if cache_dir is not None else default_cache_dir(), "installers")
+
+def fetch_modloader_installer(meta: dict, dest_dir: Optional[str] = None):
+    """Get the modloader's installer jar, reusing a verified copy from dest_dir when there is one.
+
+    dest_dir defaults to the persistent installer cache. Jars are checked against
+    the .sha1 file Maven publishes next to them. Returns the jar's path, or None
+    for vanilla packs.
+    """
+    url = modloader_installer_url(meta)
+    if url is None:
+        return None
+    if dest_dir is None:
+        dest_dir = installer_cache_dir()
+    jar_path = os.path.join(dest_dir, os.path.basename(urlparse(url).path))
+    sha1_path = jar_path + ".sha1"
+    os.makedirs(dest_dir, exist_ok=True)
+    # Installs running side by side (or in other processes) would otherwise download over each other's jar
+    with file_lock(jar_path + ".lock"):
+        if os.path.exists(jar_path) and os.path.exists(sha1_path):
+            with open(sha1_path, 'r') as f:
+                expected = f.read().strip()
+            if hash_file(jar_path, "sha1") == expected:
+                logger.info(f"Using cached installer {jar_path}")
+                return jar_path
+        expected = None
+        try:
+            response = get_downloader().session.get(url + ".sha1", timeout=get_downloader().timeout)
+            if response.status_code == 200:
+                expected = response.text.split()[0].lower()
+        except (requests.RequestException, IndexError) as e:
+            logger.warning(f"Couldn't fetch a checksum for {url}: {e}")
+        # The installer runs alongside the pack's downloads and holds up the install, so it goes first
+        download(url, jar_path, hashes={"sha1": expected} if expected else None, priority="high")
+        if expected:
+            with open(sha1_path, 'w') as f:
+                f.write(expected)
+        return jar_path
+
+def modloader_installed(meta: dict, dotminecraftpath: str):
+    """True if the launcher already has this modloader version, so its installer can be skipped"""
+    version_id = modloader_version_id(meta)
+    return os.path.isfile(os.path.join(dotminecraftpath, "versions", version_id, f"{version_id}.json"))
+
+# Installers rewrite the same files under .minecraft, so only one runs at a time
+installer_lock = threading.Lock()
+
+def run_modloader_installer(meta: dict, jar_path: str, dotminecraftpath: str):
+    """Run a downloaded installer jar against the .minecraft directory"""
+    if dotminecraftpath == "" or dotminecraftpath is None:
+        raise ValueError("installpath not provided")
+    with installer_lock:
+        if modloader_installed(meta, dotminecraftpath):
+            return
+        # The installer rewrites launcher_profiles.json too, so profile updates from other installs wait for it
+        with launcher_profiles_lock, file_lock(os.path.join(dotminecraftpath, "launcher_profiles.json.lock")):
+            # Keep the installer's log off the console (and out of --progress-json -); it's only wanted on failure
+            result = subprocess.run(["java", "-jar", jar_path, *modloader_installer_args(meta, dotminecraftpath)],
+                                    capture_output=True, text=True)
+        try:
+            result.check_returncode()
+        except subprocess.CalledProcessError as e:
+            log = "\n".join((result.stdout + result.stderr).strip().splitlines()[-20:])
+            raise InstallError(f"{MODLOADER_NAMES[meta['type']]} installer exited with status {result.returncode}:\n{log}",
+                               "modloader", [e]) from e
+
+def download_modloader(meta: dict, dotminecraftpath: str):
+    if dotminecraftpath == "" or dotminecraftpath is None: 
+        raise ValueError("installpath not provided")
+    modLoaderJarPath = None
+    if meta['type'] not in MODLOADER_NAMES:
+        return modLoaderJarPath
+    if modloader_installed(meta, dotminecraftpath):
+        print(f"{MODLOADER_NAMES[meta['type']]} {meta['version']} is already installed")
+        return modLoaderJarPath
+    print(f"Installing {MODLOADER_NAMES[meta['type']]} {meta['version']}")
+    try:
+        modLoaderJarPath = fetch_modloader_installer(meta)
+        run_modloader_installer(meta, modLoaderJarPath, dotminecraftpath)
+    except Exception as e:
+        print(f"Failed to install {MODLOADER_NAMES[meta['type']]}: {e}")
+        return e
     return modLoaderJarPath
 
 # Minecraft Launcher Profile Management (copilot made ts im sorry it's too annoying)
-import uuid
-from datetime import datetime
-from typing import Optional
+
+
+# Held around a load/modify/save of launcher_profiles.json so parallel installs don't drop each other's profiles
+launcher_profiles_lock = threading.Lock()
+
+@contextmanager
+def file_lock(path: str):
+    """Hold an exclusive lock on path, which is created if needed, against other processes too"""
+    with open(path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after 10 seconds; keep waiting
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
 
 def load_launcher_profiles(minecraft_path: str):
     """Load the launcher_profiles.json file from the provided .minecraft directory"""
@@ -106,11 +1862,45 @@ def load_launcher_profiles(minecraft_path: str):
         return parse.load(f)
 
 def save_launcher_profiles(profiles_data: dict, minecraft_path: str):
-    """Save the launcher profiles data back to file"""
+    """Save the launcher profiles data back to file.
+
+    It goes to a temporary file that is synced to disk and renamed over the old
+    one, so a crash leaves either the old file or the new one, never half of one.
+    """
     launcher_path = os.path.join(minecraft_path, "launcher_profiles.json")
-    
-    with open(launcher_path, 'w', encoding='utf-8') as f:
-        parse.dump(profiles_data, f, indent=2)
+    tmp = f"{launcher_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            parse.dump(profiles_data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(launcher_path):
+            shutil.copymode(launcher_path, tmp)
+        os.replace(tmp, launcher_path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    if os.name == "posix":
+        # Make the rename itself survive a crash
+        fd = os.open(minecraft_path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+@contextmanager
+def launcher_profiles_transaction(minecraft_path: str):
+    """Load launcher_profiles.json to change in a with block, saving it when the block ends.
+
+    The whole read-modify-write holds a lock that other threads and other
+    mrunpack processes respect, so concurrent installs can't drop each other's
+    profiles. Nothing is written if the block raises.
+    """
+    with launcher_profiles_lock, file_lock(os.path.join(minecraft_path, "launcher_profiles.json.lock")):
+        profiles_data = load_launcher_profiles(minecraft_path)
+        yield profiles_data
+        save_launcher_profiles(profiles_data, minecraft_path)
 
 def add_modpack_profile(profiles_data: dict, profile_name: str, minecraft_version: str, 
                        modloader_version: str, game_dir: str, icon_base64: Optional[str] = None):
@@ -136,5 +1926,439 @@ def add_modpack_profile(profiles_data: dict, profile_name: str, minecraft_versio
     profiles_data["profiles"][profile_id] = new_profile
     return profile_id
 
+def add_modpack_profiles(minecraft_path: str, profiles: list):
+    """Add several profiles with a single locked write of launcher_profiles.json.
+
+    Each item is a dict of add_modpack_profile's arguments after profiles_data.
+    Returns the new profile IDs in the same order.
+    """
+    with launcher_profiles_transaction(minecraft_path) as profiles_data:
+        return [add_modpack_profile(profiles_data, **profile) for profile in profiles]
+
+# Async API
+class InstallError(Exception):
+    """Raised by install_instance and install_pack when a pack can't be installed.
+
+    `step` names what failed ("target", "read", "space", "workspace", "overrides", "files",
+    "place" or "modloader") and `errors` holds the underlying exceptions, one per file for
+    "files"; for "modloader" that's the CalledProcessError with the installer's full log.
+    """
+    def __init__(self, message: str, step: str, errors: Optional[list] = None):
+        super().__init__(message)
+        self.step = step
+        self.errors = errors or []
+
+class NotEnoughSpaceError(InstallError):
+    """Raised when the pack doesn't fit; `disk` is the plan_downloads disk entry that came up short"""
+    def __init__(self, disk: dict):
+        super().__init__(f"Not enough disk space in {disk['path']}: {disk['needed'] / 1048576:.1f} MiB needed, "
+                         f"{disk['free'] / 1048576:.1f} MiB free", "space")
+        self.disk = disk
+
+def install_workspace(target: str):
+    """Working directory for installing into target. It sits next to target, so placing the instance is a rename."""
+    target = os.path.abspath(target)
+    return os.path.join(os.path.dirname(target), ".mrunpack-work", os.path.basename(target))
+
+def install_instance(mrpack_path: str, target: str, side: str = "client", optional: bool = True,
+                     include: Optional[list] = None, exclude: Optional[list] = None, link_mode: str = "move",
+                     minecraft_dir: Optional[str] = None, profile_name: Optional[str] = None, workspace: Optional[str] = None,
+                     jobs: int = 8, per_host: int = 4, use_cache: bool = True, cache_dir: Optional[str] = None,
+                     race_mirrors: bool = False, scheduler: Optional[DownloadScheduler] = None,
+                     metrics: Optional[Metrics] = None, progress: Optional[Progress] = None,
+                     cancel: Optional[threading.Event] = None, dict_obj: Optional[dict] = None,
+                     dryrun: bool = False, plan_only: bool = False, confirm=None, add_profile: bool = True):
+    """Install a .mrpack into the instance directory target without prompting, printing or exiting.
+
+    Files are staged in `workspace` (install_workspace(target) by default), so
+    an interrupted or cancelled install resumes. With minecraft_dir, a client
+    install also gets its modloader and, unless add_profile is false, a launcher
+    profile there; callers installing many packs can instead write all their
+    profiles at once with add_modpack_profiles. Returns a summary dict, with
+    "warnings" for steps that failed without stopping the install; raises
+    InstallError when it can't finish.
+
+    plan_only returns the download plan (see plan_downloads) without changing
+    anything, and dryrun stops once the files are staged. A staging directory
+    left over from another pack is deleted if confirm(message) is true, which
+    it is without a confirm.
+    """
+    cancel = cancel if cancel is not None else threading.Event()
+    def check_cancel():
+        if cancel.is_set():
+            raise DownloadCancelled(f"Install of {os.path.basename(mrpack_path)} was cancelled")
+
+    try:
+        dict_obj = dict_obj if dict_obj is not None else read_index(mrpack_path)
+    except Exception as e:
+        raise InstallError(f"Failed to read modrinth.index.json from {mrpack_path}: {e}", "read", [e]) from e
+    manifest = dict_obj.get("files", [])
+    selected = select_files(manifest, side, optional, include, exclude)
+    files, duplicates = dedupe_paths(selected)
+    modloader = check_modloader(dict_obj.get("dependencies", {}))
+    instance_path = os.path.abspath(target)
+    own_workspace = workspace is None
+    workspace = workspace if workspace is not None else install_workspace(instance_path)
+    staging_dir = os.path.join(workspace, "instance")
+    dotminecraftpath = minecraft_dir_path(minecraft_dir) if minecraft_dir is not None and side == "client" else None
+    actual_profile_name = profile_name if profile_name is not None else dict_obj.get("name", os.path.basename(instance_path))
+
+    # Work out what has to be fetched and whether it fits before touching the network
+    cache = scheduler.cache if scheduler is not None else FileCache(cache_dir) if use_cache else None
+    journal = DownloadJournal(os.path.join(workspace, "instance.journal.json"))
+    fingerprint = index_fingerprint(dict_obj)
+    resuming = os.path.isdir(staging_dir) and journal.pack == fingerprint
+    plan = plan_downloads(files, staging_dir, cache, journal if resuming else None)
+    plan["duplicates"] = duplicates
+    if not dryrun and (link_mode == "copy" or not same_filesystem(staging_dir, instance_path)):
+        # Placing the instance copies every file instead of moving or linking it
+        free = free_space(instance_path)
+        plan["target_disk"] = {"path": instance_path, "free": free, "needed": plan["bytes"], "fits": plan["bytes"] <= free}
+    if plan_only:
+        return {"pack": dict_obj.get("name"), "version": dict_obj.get("versionId"), "side": side, "target": instance_path, **plan}
+    for disk in (plan["disk"], plan.get("target_disk")):
+        if disk is not None and not disk["fits"]:
+            raise NotEnoughSpaceError(disk)
+    check_cancel()
+    if not resuming and os.path.isdir(staging_dir):
+        if confirm is not None and not confirm(f"{staging_dir} holds files from another install. Delete it and continue?"):
+            raise InstallError(f"{staging_dir} already exists", "workspace")
+        shutil.rmtree(staging_dir)
+    os.makedirs(workspace, exist_ok=True)
+    journal.start(fingerprint)
+
+    def fetch_files():
+        if scheduler is not None:
+            failures = download_files(files, staging_dir, journal=journal, scheduler=scheduler, metrics=metrics,
+                                      progress=progress, cancel=cancel)
+        else:
+            downloader = Downloader(pool_size=max(jobs, per_host), per_host=per_host, race=race_mirrors)
+            failures = download_files(files, staging_dir, jobs, per_host, downloader, cache, journal, metrics=metrics,
+                                      progress=progress, cancel=cancel)
+        check_cancel()
+        if failures:
+            raise InstallError(f"{len(failures)} of {len(files)} files failed to download", "files", [e for _, e in failures])
+        journal.remove()
+
+    def place_instance():
+        check_cancel()
+        place_tree(staging_dir, instance_path, link_mode)
+        # Only "move" uses the staging directory up; left behind, the next run would take it for an interrupted install
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        write_install_record(instance_path, dict_obj, files, pipeline.results["overrides"], side)
+        if cache is not None:
+            cache.track(instance_path, files)
+
+    def install_modloader():
+        check_cancel()
+        run_modloader_installer(modloader, pipeline.results["loader-fetch"], dotminecraftpath)
+
+    def create_profile():
+        with launcher_profiles_transaction(dotminecraftpath) as profiles_data:
+            profile_id = add_modpack_profile(profiles_data, actual_profile_name, modloader['minecraft'],
+                                             modloader_version_id(modloader), instance_path)
+        return profile_id
+
+    # Nothing to show progress on unless the caller passed a Progress of its own
+    own_progress = progress is None
+    if own_progress:
+        progress = Progress(bar=False)
+    # Fetching and running the modloader installer doesn't need the pack's files,
+    # so it runs alongside the downloads instead of after them
+    loader = None
+    pipeline = Pipeline(metrics=metrics, labels={"pack": actual_profile_name})
+    pipeline.add("overrides", lambda: extract_overrides(mrpack_path, staging_dir, side))
+    pipeline.add("files", fetch_files, deps=["overrides"])
+    if not dryrun:
+        pipeline.add("place", place_instance, deps=["overrides", "files"])
+        if dotminecraftpath is not None:
+            if modloader['type'] in MODLOADER_NAMES and modloader_installed(modloader, dotminecraftpath):
+                loader = "present"
+            elif modloader['type'] in MODLOADER_NAMES:
+                loader = "installed"
+                installer_dir = installer_cache_dir(cache_dir) if use_cache else os.path.join(workspace, ".tmp")
+                pipeline.add("loader-fetch", lambda: fetch_modloader_installer(modloader, installer_dir))
+                pipeline.add("loader-install", install_modloader, deps=["loader-fetch"])
+            if add_profile:
+                pipeline.add("profile", create_profile, deps=["place"], after=["loader-install"])
+    try:
+        results, errors, skipped = pipeline.run()
+    finally:
+        if own_progress:
+            progress.close()
+    check_cancel()
+    for step in ("overrides", "files", "place"):
+        if step in errors:
+            if isinstance(errors[step], InstallError):
+                raise errors[step]
+            raise InstallError(f"{step} failed: {errors[step]}", step, [errors[step]]) from errors[step]
+    if "loader-fetch" in errors or "loader-install" in errors:
+        loader = "failed"
+    # The workspace may be the caller's, so only take out what this install put there
+    shutil.rmtree(os.path.join(workspace, ".tmp"), ignore_errors=True)
+    for path in () if dryrun else (workspace, os.path.dirname(workspace)) if own_workspace else (workspace,):
+        try:
+            os.rmdir(path)
+        except OSError:
+            # Not empty: other installs are still using it
+            break
+    return {"pack": dict_obj.get("name"), "version": dict_obj.get("versionId"), "side": side, "target": instance_path,
+            "files": len(files), "bytes": plan["bytes"], "downloaded": plan["download"]["files"], "duplicates": duplicates,
+            "skipped": len(manifest) - len(selected), "resumed": resuming, "staging": staging_dir if dryrun else None,
+            "overrides": len(results["overrides"]), "modloader": modloader, "loader": loader, "profile_name": actual_profile_name,
+            "profile": results.get("profile"), "warnings": {step: str(error) for step, error in errors.items()}}
+
+async def install_pack(mrpack_path: str, target: str, **options):
+    """Install a .mrpack into target from asyncio code; options are install_instance's keyword arguments.
+
+    The blocking work runs on a worker thread, so many installs can be awaited
+    at once from one event loop; pass them one DownloadScheduler to share its
+    download limits and cache. Cancelling the task stops the downloads, waits
+    for the worker to wind down and raises CancelledError; installing the same
+    pack into the same target again picks up where it stopped.
+    """
+    cancel = threading.Event()
+    worker = asyncio.ensure_future(asyncio.to_thread(install_instance, mrpack_path, target, cancel=cancel, **options))
+    try:
+        return await asyncio.shield(worker)
+    except asyncio.CancelledError:
+        cancel.set()
+        try:
+            await worker
+        except Exception:
+            pass
+        raise
+
+# Install Service
+class IndexCache:
+    """Parsed modrinth.index.json files by .mrpack path, read again only when the file changes.
+
+    The dicts are shared by every caller, so treat them as read-only.
+    """
+    def __init__(self, size: int = 64):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, mrpack_path: str):
+        path = os.path.abspath(mrpack_path)
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            cached = self.entries.get(path)
+            if cached is not None and cached[0] == stamp:
+                self.entries.move_to_end(path)
+                return cached[1]
+        dict_obj = read_index(path)
+        with self.lock:
+            self.entries[path] = (stamp, dict_obj)
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return dict_obj
+
+class ServiceJob:
+    """One request queued on an InstallService; wait() blocks until it has run"""
+    def __init__(self, id: int, op: str, args: dict, priority: int):
+        self.id = id
+        self.op = op
+        self.args = args
+        self.priority = priority
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self, timeout: Optional[float] = None):
+        return self.done.wait(timeout)
+
+    def response(self):
+        if self.error is None:
+            return {"id": self.id, "ok": True, "result": self.result}
+        return {"id": self.id, "ok": False, "error": str(self.error), "type": type(self.error).__name__,
+                "step": getattr(self.error, "step", None)}
+
+class InstallService:
+    """Runs install, verify and defaults jobs for `mrunpack serve` on a fixed number of worker threads.
+
+    Jobs wait in a priority queue, higher priority first and then in order of
+    arrival. What makes a fresh process slow is kept between jobs: the
+    DownloadScheduler with its open connections and cache, parsed manifests,
+    and the cached modloader installers, whose lock also keeps two jobs from
+    running the same installer.
+    """
+    OPS = ("install", "verify", "defaults")
+
+    def __init__(self, workers: int = 2, jobs: int = 8, per_host: int = 4, use_cache: bool = True,
+                 cache_dir: Optional[str] = None, race_mirrors: bool = False, minecraft_dir: Optional[str] = None):
+        downloader = Downloader(pool_size=max(jobs, per_host), per_host=per_host, race=race_mirrors)
+        self.scheduler = DownloadScheduler(jobs, downloader, FileCache(cache_dir) if use_cache else None)
+        self.use_cache = use_cache
+        self.cache_dir = cache_dir
+        self.minecraft_dir = minecraft_dir
+        self.indexes = IndexCache()
+        # Forking a process pool per verify from this multithreaded server isn't safe, so hash on threads;
+        # hashlib lets go of the GIL for big reads
+        self.hash_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="verify")
+        self.queue = queue.PriorityQueue()
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.running = {}
+        # Instance directories being installed into right now
+        self.targets = set()
+        self.workers = [threading.Thread(target=self.work, name=f"service-{i}", daemon=True) for i in range(max(1, workers))]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, op: str, args: Optional[dict] = None, priority: int = 0):
+        """Queue a job; args are the keyword arguments of the method named op"""
+        if op not in self.OPS:
+            raise ValueError(f"Unknown job {op!r}, expected one of {', '.join(self.OPS)}")
+        job = ServiceJob(next(self.ids), op, args or {}, priority)
+        self.queue.put((-priority, job.id, job))
+        return job
+
+    def work(self):
+        while True:
+            _, _, job = self.queue.get()
+            if job is None:
+                return
+            with self.lock:
+                self.running[job.id] = job
+            try:
+                job.result = getattr(self, job.op)(**job.args)
+            except Exception as e:
+                logger.error(f"Job {job.id} ({job.op}) failed: {e}")
+                job.error = e
+            finally:
+                with self.lock:
+                    del self.running[job.id]
+                job.done.set()
+
+    def install(self, mrpack: str, target: str, **options):
+        options.setdefault("minecraft_dir", self.minecraft_dir)
+        try:
+            dict_obj = self.indexes.get(mrpack)
+        except Exception as e:
+            raise InstallError(f"Failed to read modrinth.index.json from {mrpack}: {e}", "read", [e]) from e
+        key = os.path.normcase(os.path.abspath(target))
+        with self.lock:
+            if key in self.targets:
+                raise InstallError(f"Another job is already installing into {target}", "target")
+            self.targets.add(key)
+        try:
+            return install_instance(mrpack, target, use_cache=self.use_cache, cache_dir=self.cache_dir, scheduler=self.scheduler,
+                                    dict_obj=dict_obj, **options)
+        finally:
+            with self.lock:
+                self.targets.discard(key)
+
+    def verify(self, mrpack: str, target: str, repair: bool = False, side: Optional[str] = None, optional: bool = True,
+               include: Optional[list] = None, exclude: Optional[list] = None):
+        files, known, side = expected_files(self.indexes.get(mrpack), target, side, optional, include, exclude)
+        report = verify_instance(files, target, known=known, pool=self.hash_pool)
+        if repair and (report["missing"] or report["corrupt"]):
+            progress = Progress(bar=False)
+            try:
+                repair_files(files, report, target, self.scheduler, progress=progress)
+            finally:
+                progress.close()
+        return report
+
+    def defaults(self, mrpack: str):
+        return pack_defaults(self.indexes.get(mrpack), mrpack)
+
+    def status(self):
+        with self.lock:
+            running = [{"id": job.id, "op": job.op, "priority": job.priority} for job in self.running.values()]
+        return {"queued": self.queue.qsize(), "running": running, "workers": len(self.workers), "manifests": len(self.indexes.entries)}
+
+    def close(self):
+        """Let the running jobs finish, then stop the workers"""
+        for _ in self.workers:
+            self.queue.put((float("inf"), next(self.ids), None))
+        for worker in self.workers:
+            worker.join()
+        self.hash_pool.shutdown()
+        self.scheduler.close()
+
+class ServiceHandler(socketserver.StreamRequestHandler):
+    """One client connection: a JSON request per line in, a JSON response per line out.
+
+    A request is {"op": ..., "args": {...}, "priority": 0}. "status" and
+    "shutdown" are answered straight away; everything else waits for its job.
+    """
+    def handle(self):
+        service = self.server.service
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            stop = False
+            try:
+                request = parse.loads(line)
+                op = request.get("op")
+                if op == "status":
+                    response = {"ok": True, "result": service.status()}
+                elif op == "shutdown":
+                    response = {"ok": True, "result": None}
+                    stop = True
+                else:
+                    job = service.submit(op, request.get("args"), request.get("priority", 0))
+                    job.wait()
+                    response = job.response()
+            except Exception as e:
+                response = {"ok": False, "error": str(e), "type": type(e).__name__}
+            self.wfile.write((parse.dumps(response, default=str) + "\n").encode("utf-8"))
+            if stop:
+                # shutdown() waits for serve_forever to return, so it can't run on this thread
+                threading.Thread(target=self.server.shutdown).start()
+                return
+
+def default_socket_path():
+    """Where `mrunpack serve` listens unless told otherwise: the user's runtime directory, else the cache directory"""
+    return os.path.join(os.environ.get("XDG_RUNTIME_DIR") or default_cache_dir(), "mrunpack.sock")
+
+def serve(socket_path: str, service: InstallService):
+    """Answer requests for service on a Unix socket until a client sends "shutdown" """
+    if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+        raise OSError("mrunpack serve needs Unix domain sockets, which this platform doesn't have")
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except OSError:
+            # Left behind by a server that didn't shut down cleanly
+            os.remove(socket_path)
+        else:
+            raise OSError(f"Another mrunpack server is already listening on {socket_path}")
+        finally:
+            probe.close()
+    os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+    # Create the socket private to this user from the start, so nobody else can connect before a chmod
+    umask = os.umask(0o077)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(socket_path, ServiceHandler)
+    finally:
+        os.umask(umask)
+    server.daemon_threads = True
+    server.service = service
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+def service_request(socket_path: str, op: str, args: Optional[dict] = None, priority: int = 0, timeout: Optional[float] = None):
+    """Send one request to a running `mrunpack serve` and return its response"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(socket_path)
+        client.sendall((parse.dumps({"op": op, "args": args or {}, "priority": priority}) + "\n").encode("utf-8"))
+        with client.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError(f"{socket_path} closed the connection without answering")
+    return parse.loads(line)
+
 if __name__ == "__main__":
     raise NotImplementedError("this is a library. you cant run it directly")
\ No newline at end of file
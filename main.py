@@ -1,8 +1,11 @@
-from lib import download, mrpack2zip, extractzip, jsonparse, check_modloader, load_launcher_profiles, save_launcher_profiles, add_modpack_profile, download_modloader
+from lib import default_bandwidth, collect_garbage, InstallService, serve, default_socket_path, pack_defaults, expected_files, repair_files, verify_instance, plan_downloads, dedupe_paths, instance_file, parse_size, Progress, Metrics, DownloadScheduler, find_packs, pack_workspace, launcher_profiles_transaction, MODLOADER_NAMES, INSTALL_RECORD, read_install_record, write_install_record, diff_manifests, upgrade_overrides, modloader_version_id, minecraft_dir_path, download_files, Downloader, FileCache, DownloadJournal, index_fingerprint, read_index, select_files, SIDES, LINK_MODES, check_modloader, download_modloader, install_instance, InstallError, NotEnoughSpaceError, add_modpack_profiles, DownloadCancelled
 import argparse
+import json
+import sys
 import logging
 import shutil, os
-from tqdm import tqdm
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from typing import Optional
 
 # region 
@@ -10,231 +13,564 @@ from typing import Optional
 # endregion
 logger = logging.getLogger(__name__)
 
-def unpack_mrpack(input_mrpack_path, dryrun: bool=False, minecraft_dir: str="Default", profile_dir: Optional[str]=None, profile_name: Optional[str]=None):
+def pack_target(input_mrpack_path, dict_obj: dict, minecraft_dir: str="Default", profile_dir: Optional[str]=None, profile_name: Optional[str]=None, side: str="client"):
+    """The instance directory unpack_mrpack installs a pack into"""
+    actual_profile_name = profile_name if profile_name is not None else dict_obj.get("name", os.path.splitext(os.path.basename(input_mrpack_path))[0])
+    if side == "server":
+        return os.path.abspath(profile_dir if profile_dir is not None else actual_profile_name)
+    elif profile_dir is None:
+        return os.path.join(minecraft_dir_path(minecraft_dir), actual_profile_name)
+    return os.path.abspath(profile_dir)
+
+def unpack_mrpack(input_mrpack_path, dryrun: bool=False, minecraft_dir: str="Default", profile_dir: Optional[str]=None, profile_name: Optional[str]=None, jobs: int=8, per_host: int=4, use_cache: bool=True, cache_dir: Optional[str]=None, link_mode: str="move", race_mirrors: bool=False,
+                  side: str="client", optional: bool=True, include: Optional[list]=None, exclude: Optional[list]=None,
+                  workspace: str=".", confirm=None, add_profile: bool=True, scheduler: Optional[DownloadScheduler]=None, metrics: Optional[Metrics]=None,
+                  progress: Optional[Progress]=None, plan_only: bool=False, cancel: Optional[threading.Event]=None):
     """
-    Unpacks a .mrpack file and downloads its dependencies.
+    Unpacks a .mrpack file and downloads its dependencies with install_instance, printing what happened.
     
     Args:
         input_mrpack_path (str): Path to the .mrpack file to unpack
+        workspace (str): Directory holding the .tmp and instance working directories
+        confirm (callable): Asked whether to delete another install's leftovers from the workspace; they're deleted without it
+        add_profile (bool): Create the launcher profile; install_packs adds all of its packs' profiles in one go instead
+        scheduler (DownloadScheduler): Download workers and cache shared with other installs
+        metrics (Metrics): Collects phase timings and per-file download stats
+        progress (Progress): Where to report download progress instead of a bar of its own
+        plan_only (bool): Return the download plan (see plan_downloads) without changing anything
+        cancel (threading.Event): Set to stop the install, keeping what's been downloaded for a resume
+    
+    Returns:
+        dict: install_instance's summary, or the plan with plan_only
+    
+    Raises:
+        InstallError: When the pack can't be installed; staged files are kept so running it again resumes
     """
-    if os.path.isdir(".tmp"):
-        print(".tmp folder found. Script may have been cancelled or crashed.")
-        confirm = input("Delete it and continue? (y/N) ")
-        if confirm.lower() == 'y':
-            shutil.rmtree(".tmp")
-        else:
-            logger.warning(".tmp folder already exists! Aborting!")
-            exit(1)
-
-    zipfilepath = mrpack2zip(input_mrpack_path)
     try:
-        extractzip(str(zipfilepath))
+        dict_obj = read_index(input_mrpack_path)
     except Exception as e:
-        print(f"Failed to extract mrpack file: {e}")
-        exit(1)
+        raise InstallError(f"Failed to read modrinth.index.json: {e}", "read", [e]) from e
+    # Use provided profile name or default from mrpack metadata
+    actual_profile_name = profile_name if profile_name is not None else dict_obj.get("name", os.path.splitext(os.path.basename(input_mrpack_path))[0])
+    instance_path = pack_target(input_mrpack_path, dict_obj, minecraft_dir, profile_dir, profile_name, side)
+    own_progress = progress is None and not plan_only
+    if own_progress:
+        progress = Progress()
     try:
-        with open(".tmp/modrinth.index.json") as f:
-            dict_obj = jsonparse(f.read())
-            if not isinstance(dict_obj, dict):
-                dict_obj = dict(dict_obj)
-    except Exception as e:
-        print(f"Failed to access modrinth.index.json: {e}")
-    if os.path.isdir("instance"):
-        print("instance folder found. Script may have been cancelled or crashed.")
-        confirm = input("Delete it and continue? (y/N) ")
-        if confirm.lower() == 'y':
-            shutil.rmtree("instance")
-        else:
-            logger.warning("instance folder already exists! Aborting!")
-            exit(1)
-    shutil.copytree(".tmp/overrides", "instance")
-
-    files = dict_obj.get("files")
-    try: 
-        if files is not None:
-            # Create progress bar for overall file download progress
-            with tqdm(total=len(files), desc="Downloading files", unit="file") as overall_pbar:
-                for i in files:
-                    download(i["downloads"][0], f"instance/{i["path"]}")
-                    overall_pbar.update(1)
-        else:
-            logger.critical("Invalid modrinth.index.json: No files entry")
-    except Exception as e:
-        logger.critical(f"Unable to download files: {e}")
-    if dryrun == True:
-        print("Files have been unpacked to ./instance")
-        print("Cleaning up extra files...")
+        summary = install_instance(input_mrpack_path, instance_path, side, optional, include, exclude, link_mode, minecraft_dir,
+                                   actual_profile_name, workspace, jobs, per_host, use_cache, cache_dir, race_mirrors, scheduler,
+                                   metrics, progress, cancel, dict_obj, dryrun=dryrun, plan_only=plan_only, confirm=confirm,
+                                   add_profile=add_profile)
+    finally:
+        if own_progress:
+            progress.close()
+    if plan_only:
+        return summary
+
+    if summary["skipped"]:
+        print(f"Skipped {summary['skipped']} files not needed on the {side}")
+    if summary["resumed"]:
+        print(f"Resumed an interrupted install of {actual_profile_name}")
+    if dryrun:
+        print(f"Files have been unpacked to {summary['staging']}")
+        return summary
+    modloader = summary["modloader"]
+    if summary["loader"] == "present":
+        print(f"{MODLOADER_NAMES[modloader['type']]} {modloader['version']} is already installed")
+    elif summary["loader"] == "installed":
+        print(f"Installed {MODLOADER_NAMES[modloader['type']]} {modloader['version']}")
+    elif summary["loader"] == "failed":
+        print(f"Failed to install {MODLOADER_NAMES[modloader['type']]}: {summary['warnings'].get('loader-fetch') or summary['warnings'].get('loader-install')}")
+    if side == "server":
+        print(f"Server files installed to {instance_path}")
+        print("Skipping modloader and launcher profile for a server install.")
+    elif "profile" in summary["warnings"]:
+        print(f"Failed to create launcher profile: {summary['warnings']['profile']}")
+        print("The modpack was unpacked successfully, but you'll need to create the launcher profile manually.")
+    elif summary["profile"] is not None:
+        print(f"Successfully created launcher profile: {actual_profile_name}")
+        print(f"Profile ID: {summary['profile']}")
+    return summary
+
+def install_packs(paths: list, minecraft_dir: str="Default", jobs: int=8, per_host: int=4, use_cache: bool=True, cache_dir: Optional[str]=None, link_mode: str="move", race_mirrors: bool=False,
+                  side: str="client", optional: bool=True, include: Optional[list]=None, exclude: Optional[list]=None, parallel: int=2,
+                  metrics: Optional[Metrics]=None, progress: Optional[Progress]=None, cancel: Optional[threading.Event]=None):
+    """
+    Installs several .mrpack files in one go. Each pack gets its own workspace under
+    ./.mrunpack-work, while all of them share one download scheduler and cache, so a
+    file that several packs use is only downloaded once.
+    
+    Args:
+        paths (list): .mrpack files, directories containing them, or glob patterns
+        parallel (int): How many packs to install at the same time
+        metrics (Metrics): Collects phase timings and download stats for every pack
+        progress (Progress): Where to report download progress; by default one bar covers every pack
+        cancel (threading.Event): Set to stop every install, keeping what's been downloaded for a resume
+    
+    Returns:
+        dict: Pack path -> reason, for every pack that failed to install
+    """
+    cancel = cancel if cancel is not None else threading.Event()
+    packs = find_packs(paths)
+    if not packs:
+        print("No .mrpack files found.")
+        return {}
+    failed = {}
+    # Packs with the same name (e.g. two versions of one pack) would overwrite each other's instance
+    targets = {}
+    for pack in packs:
+        try:
+            target = os.path.normcase(pack_target(pack, read_index(pack), minecraft_dir, side=side))
+        except Exception:
+            # unpack_mrpack reports packs it can't read
+            continue
+        first = targets.setdefault(target, pack)
+        if first != pack:
+            failed[pack] = f"it would install into {target}, like {first}; install it on its own with --profile-dir"
+    work_root = os.path.dirname(pack_workspace(packs[0]))
+    # Without the shared cache, packs still need somewhere to share files that outlives any one of them
+    scratch_cache = os.path.join(work_root, "cache")
+    cache = FileCache(cache_dir if use_cache else scratch_cache)
+    downloader = Downloader(pool_size=max(jobs, per_host), per_host=per_host, race=race_mirrors)
+    scheduler = DownloadScheduler(jobs, downloader, cache)
+    own_progress = progress is None
+    if own_progress:
+        progress = Progress()
+
+    # Launcher profiles are added together at the end, so launcher_profiles.json is written once
+    installed = {}
+
+    def install(pack):
+        workspace = pack_workspace(pack)
+        os.makedirs(workspace, exist_ok=True)
         try:
-            shutil.rmtree('.tmp')
-            os.remove(zipfilepath)
+            installed[pack] = unpack_mrpack(pack, minecraft_dir=minecraft_dir, link_mode=link_mode, side=side, optional=optional, include=include,
+                                            exclude=exclude, use_cache=use_cache, cache_dir=cache_dir, workspace=workspace, add_profile=False,
+                                            scheduler=scheduler, metrics=metrics, progress=progress, cancel=cancel)
+        except InstallError as e:
+            # Keep anything staged so a rerun resumes
+            if os.path.isdir(os.path.join(workspace, "instance")):
+                failed[pack] = f"{e} (partial install kept in {workspace})"
+            else:
+                shutil.rmtree(workspace, ignore_errors=True)
+                failed[pack] = str(e)
+            return
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    print(f"Installing {len(packs)} packs")
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, parallel)) as pool:
+            futures = {pool.submit(install, pack): pack for pack in packs if pack not in failed}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    failed[futures[future]] = str(e)
+    finally:
+        if own_progress:
+            progress.close()
+        scheduler.close(cancel_futures=cancel.is_set())
+        shutil.rmtree(scratch_cache, ignore_errors=True)
+    try:
+        os.rmdir(work_root)
+    except OSError:
+        pass
+
+    if side == "client" and installed:
+        summaries = [installed[pack] for pack in packs if pack in installed]
+        try:
+            profile_ids = add_modpack_profiles(minecraft_dir_path(minecraft_dir), [
+                {"profile_name": summary["profile_name"], "minecraft_version": summary["modloader"]["minecraft"],
+                 "modloader_version": modloader_version_id(summary["modloader"]), "game_dir": summary["target"]}
+                for summary in summaries])
         except Exception as e:
-            print(f"Couldn't cleanup temp files! Error: {e}")
-            print(f"You may need to delete the .tmp folder and {zipfilepath}")
-        print("Exiting due to dryrun being set.")
-        exit(1)
-    ## Now it's the fun part! Installing the profile into the Minecraft launcher
-    deps = dict_obj["dependencies"]
-    modloader = check_modloader(deps)
-    # Determine .minecraft path based on OS if not provided
-    if minecraft_dir == "Default":
-        if os.name == "nt":
-            dotminecraftpath = os.path.expandvars(r"%APPDATA%\.minecraft")
-        elif os.name == "posix":
-            dotminecraftpath = os.path.expanduser("~/.minecraft")
+            print(f"Failed to create launcher profiles: {e}")
+            print("The modpacks were unpacked successfully, but you'll need to create their launcher profiles manually.")
         else:
-            logger.warning("Unknown OS, using current directory for .minecraft")
-            dotminecraftpath = os.path.abspath(".minecraft")
-    else:
-        dotminecraftpath = minecraft_dir
-    download_modloader(modloader, dotminecraftpath)
+            for summary, profile_id in zip(summaries, profile_ids):
+                print(f"Successfully created launcher profile: {summary['profile_name']} (Profile ID: {profile_id})")
+
+    print(f"Installed {len(packs) - len(failed)} of {len(packs)} packs")
+    for pack, reason in failed.items():
+        print(f"  {pack} failed: {reason}")
+    return failed
+
+def upgrade_mrpack(input_mrpack_path, instance_path: str, minecraft_dir: str="Default", jobs: int=8, per_host: int=4, use_cache: bool=True, cache_dir: Optional[str]=None, race_mirrors: bool=False,
+                   side: Optional[str]=None, optional: bool=True, include: Optional[list]=None, exclude: Optional[list]=None,
+                   metrics: Optional[Metrics]=None, progress: Optional[Progress]=None, plan_only: bool=False,
+                   cancel: Optional[threading.Event]=None):
+    """
+    Upgrades an instance installed by unpack_mrpack to another version of its pack,
+    downloading only added or changed files and leaving everything else alone.
+    
+    Args:
+        input_mrpack_path (str): Path to the new .mrpack file
+        instance_path (str): The installed instance to upgrade
+        minecraft_dir (str): Path to .minecraft directory
+        side (str): "client" or "server"; defaults to whatever the instance was installed for
+        metrics (Metrics): Collects phase timings and per-file download stats
+        progress (Progress): Where to report download progress instead of a bar of its own
+        plan_only (bool): Return the download plan (see plan_downloads) without changing anything
+        cancel (threading.Event): Set to stop the upgrade before anything is changed, keeping what's been downloaded for a resume
     
-    # Load launcher profiles and add new modpack profile
+    Raises:
+        InstallError: When the instance can't be upgraded; downloaded files are kept so running it again resumes
+    """
+    metrics = metrics if metrics is not None else Metrics()
+    record = read_install_record(instance_path)
+    if record is None:
+        raise InstallError(f"{instance_path} has no {INSTALL_RECORD}, so it can't be upgraded. Install the pack normally instead.", "target")
     try:
-        profiles_data = load_launcher_profiles(dotminecraftpath)
-        
-        # Use provided profile name or default from mrpack metadata
-        actual_profile_name = profile_name if profile_name is not None else dict_obj.get("name", os.path.splitext(os.path.basename(input_mrpack_path))[0])
-        
-        # Determine instance/profile directory
-        if profile_dir is None:
-            instance_path = os.path.join(dotminecraftpath, actual_profile_name)
-            # Copy instance to the profile directory
-            if os.path.exists(instance_path):
-                shutil.rmtree(instance_path)
-            shutil.copytree("instance", instance_path)
-        else:
-            instance_path = os.path.abspath(profile_dir)
-            # Copy instance to the specified directory
-            if os.path.exists(instance_path):
-                shutil.rmtree(instance_path)
-            shutil.copytree("instance", instance_path)
-        
-        # Create modloader version string (format varies by type)
-        if modloader['type'] == 'fabric':
-            modloader_version = f"fabric-loader-{modloader['version']}-{modloader['minecraft']}"
-        elif modloader['type'] == 'forge':
-            modloader_version = f"forge-{modloader['minecraft']}-{modloader['version']}"
-        elif modloader['type'] == 'quilt':
-            modloader_version = f"quilt-loader-{modloader['version']}-{modloader['minecraft']}"
-        elif modloader['type'] == 'neoforge':
-            modloader_version = f"neoforge-{modloader['version']}"
-        else:
-            modloader_version = modloader['minecraft']  # Fallback to vanilla
-        
-        # Add the profile
-        profile_id = add_modpack_profile(
-            profiles_data, 
-            actual_profile_name, 
-            modloader['minecraft'], 
-            modloader_version, 
-            instance_path
-        )
-        
-        # Save the updated profiles
-        save_launcher_profiles(profiles_data, dotminecraftpath)
-        
-        print(f"Successfully created launcher profile: {actual_profile_name}")
-        print(f"Profile ID: {profile_id}")
-        
+        dict_obj = read_index(input_mrpack_path)
     except Exception as e:
-        print(f"Failed to create launcher profile: {e}")
-        print("The modpack was unpacked successfully, but you'll need to create the launcher profile manually.")
+        raise InstallError(f"Failed to read modrinth.index.json: {e}", "read", [e]) from e
+    side = side if side is not None else record.get("side", "client")
+    files, _ = dedupe_paths(select_files(dict_obj.get("files", []), side, optional, include, exclude))
+    plan = diff_manifests(record["index"].get("files", []), files, instance_path)
+    journal = DownloadJournal(os.path.join(instance_path, ".mrunpack-journal.json"))
+    cache = FileCache(cache_dir) if use_cache else None
+    download_plan = plan_downloads(plan["added"] + plan["changed"], instance_path, cache,
+                                   journal if journal.pack == index_fingerprint(dict_obj) else None)
+    if plan_only:
+        return {"pack": dict_obj.get("name"), "version": dict_obj.get("versionId"), "side": side, "target": instance_path,
+                "removed": [entry["path"] for entry in plan["removed"]], "unchanged": len(plan["unchanged"]), **download_plan}
+    if not download_plan["disk"]["fits"]:
+        raise NotEnoughSpaceError(download_plan["disk"])
+    print(f"Upgrading {instance_path} to {dict_obj.get('name')} {dict_obj.get('versionId')}: "
+          f"{len(plan['added'])} added, {len(plan['changed'])} changed, {len(plan['removed'])} removed, {len(plan['unchanged'])} unchanged")
+
+    journal.start(index_fingerprint(dict_obj))
+    downloader = Downloader(pool_size=max(jobs, per_host), per_host=per_host, race=race_mirrors)
+    with metrics.span("files"):
+        failures = download_files(plan["added"] + plan["changed"], instance_path, jobs, per_host, downloader, cache, journal, metrics=metrics, progress=progress,
+                                  cancel=cancel)
+    if cancel is not None and cancel.is_set():
+        raise DownloadCancelled(f"Upgrade of {instance_path} was cancelled")
+    if failures:
+        raise InstallError(f"{len(failures)} files failed to download", "files", [e for _, e in failures])
+    journal.remove()
+    with metrics.span("overrides"):
+        for entry in plan["removed"]:
+            path = instance_file(instance_path, entry["path"])
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+        overrides = upgrade_overrides(input_mrpack_path, instance_path, record.get("overrides", {}), side)
+        write_install_record(instance_path, dict_obj, files, overrides, side)
+        if cache is not None:
+            cache.track(instance_path, files)
+
+    if side == "client" and dict_obj.get("dependencies") != record["index"].get("dependencies"):
+        modloader = check_modloader(dict_obj["dependencies"])
+        dotminecraftpath = minecraft_dir_path(minecraft_dir)
+        with metrics.span("loader-install"):
+            download_modloader(modloader, dotminecraftpath)
+        try:
+            with launcher_profiles_transaction(dotminecraftpath) as profiles_data:
+                for profile in profiles_data.get("profiles", {}).values():
+                    if os.path.abspath(profile.get("gameDir", "")) == os.path.abspath(instance_path):
+                        profile["lastVersionId"] = modloader_version_id(modloader)
+        except Exception as e:
+            print(f"Failed to update launcher profile: {e}")
+    print(f"Upgraded {instance_path}")
+
+def verify_mrpack(input_mrpack_path, instance_path: str, repair: bool=False, workers: Optional[int]=None, jobs: int=8, per_host: int=4, use_cache: bool=True, cache_dir: Optional[str]=None,
+                  race_mirrors: bool=False, side: Optional[str]=None, optional: bool=True, include: Optional[list]=None, exclude: Optional[list]=None,
+                  metrics: Optional[Metrics]=None, progress: Optional[Progress]=None):
+    """
+    Checks an installed instance against its pack, hashing every file on all CPU cores,
+    and with repair downloads again only the files that are missing or corrupt.
     
+    Args:
+        input_mrpack_path (str): Path to the .mrpack file the instance was installed from
+        instance_path (str): The installed instance to check
+        repair (bool): Re-download missing and corrupt files
+        workers (int): Processes to hash with (default: one per CPU)
+        side (str): "client" or "server"; defaults to whatever the instance was installed for
+    
+    Returns:
+        dict: Path lists for "ok", "missing", "corrupt" and "extra" files, plus "repaired" and "failed" with repair
+    
+    Raises:
+        InstallError: When the instance or the pack can't be read
+    """
+    metrics = metrics if metrics is not None else Metrics()
+    if not os.path.isdir(instance_path):
+        raise InstallError(f"{instance_path} doesn't exist.", "target")
+    try:
+        dict_obj = read_index(input_mrpack_path)
+    except Exception as e:
+        raise InstallError(f"Failed to read modrinth.index.json: {e}", "read", [e]) from e
+    files, known, side = expected_files(dict_obj, instance_path, side, optional, include, exclude)
+
+    with metrics.span("verify"):
+        report = verify_instance(files, instance_path, workers, known)
+    print(f"Checked {len(files)} files in {instance_path}: {len(report['ok'])} ok, {len(report['missing'])} missing, "
+          f"{len(report['corrupt'])} corrupt, {len(report['extra'])} not in the pack")
+    for name in ("missing", "corrupt", "extra"):
+        for path in report[name]:
+            print(f"  {name}: {path}")
+    if not repair or not (report["missing"] or report["corrupt"]):
+        return report
+
+    downloader = Downloader(pool_size=max(jobs, per_host), per_host=per_host, race=race_mirrors)
+    scheduler = DownloadScheduler(jobs, downloader, FileCache(cache_dir) if use_cache else None)
+    try:
+        with metrics.span("files"):
+            repair_files(files, report, instance_path, scheduler, metrics, progress)
+    finally:
+        scheduler.close()
+    print(f"Repaired {len(report['repaired'])} files" + (f", {len(report['failed'])} still broken" if report["failed"] else ""))
+    return report
 
 def get_defaults(input_mrpack_path):
     """
-    Extract and display default options for the given mrpack file
+    Display default options for the given mrpack file
     
     Args:
         input_mrpack_path (str): Path to the .mrpack file
     """
     try:
-        # Temporarily extract to get metadata
-        if os.path.isdir(".tmp"):
-            shutil.rmtree(".tmp")
-        
-        zipfilepath = mrpack2zip(input_mrpack_path)
-        extractzip(str(zipfilepath))
-        
-        # Parse metadata
-        with open(".tmp/modrinth.index.json") as f:
-            dict_obj = jsonparse(f.read())
-            if not isinstance(dict_obj, dict):
-                dict_obj = dict(dict_obj)
-        
-        # Get modloader info
-        deps = dict_obj["dependencies"]
-        modloader = check_modloader(deps)
-        
-        # Default .minecraft path based on OS
-        if os.name == "nt":
-            default_minecraft = os.path.expandvars(r"%APPDATA%\.minecraft")
-        elif os.name == "posix":
-            default_minecraft = os.path.expanduser("~/.minecraft")
-        else:
-            default_minecraft = os.path.abspath(".minecraft")
-        
-        # Extract defaults
-        profile_name = dict_obj.get("name", os.path.splitext(os.path.basename(input_mrpack_path))[0])
-        version_id = dict_obj.get("versionId", "1.0.0")
-        minecraft_version = modloader.get('minecraft', 'unknown')
-        modloader_type = modloader.get('type', 'unknown')
-        modloader_version = modloader.get('version', 'unknown')
-        
-        # Default profile directory
-        profile_dir = os.path.join(default_minecraft, profile_name)
-        
-        # Create modloader version string for launcher
-        if modloader_type == 'fabric':
-            launcher_version = f"fabric-loader-{modloader_version}-{minecraft_version}"
-        elif modloader_type == 'forge':
-            launcher_version = f"forge-{minecraft_version}-{modloader_version}"
-        elif modloader_type == 'quilt':
-            launcher_version = f"quilt-loader-{modloader_version}-{minecraft_version}"
-        elif modloader_type == 'neoforge':
-            launcher_version = f"neoforge-{modloader_version}"
-        else:
-            launcher_version = minecraft_version
-        
+        # Only modrinth.index.json is needed, so read it straight from the archive
+        dict_obj = read_index(input_mrpack_path)
         # Output clean JSON for programmatic use
-        defaults = {
-            "profile_name": profile_name,
-            "version_id": version_id,
-            "minecraft_dir": default_minecraft,
-            "profile_dir": profile_dir
-        }
-        
-        import json
-        print(json.dumps(defaults, indent=2))
-        
-        # Clean up
-        shutil.rmtree(".tmp")
-        os.remove(zipfilepath)
+        print(json.dumps(pack_defaults(dict_obj, input_mrpack_path), indent=2))
         
     except Exception as e:
         print(f"Error getting defaults: {e}")
-        # Clean up on error
-        if os.path.isdir(".tmp"):
-            shutil.rmtree(".tmp")
-        if os.path.exists(zipfilepath):
-            os.remove(zipfilepath)
 
-if __name__ == "__main__":
+def add_install_arguments(argp):
+    """Options shared by the single-pack CLI and `install`"""
+    argp.add_argument("--minecraft-dir", type=str, help="Path to .minecraft directory (auto-detected if not provided)")
+    argp.add_argument("-j", "--jobs", type=int, default=8, help="Number of files to download at once (default: 8)")
+    argp.add_argument("--per-host", type=int, default=4, help="Maximum simultaneous downloads from one host (default: 4)")
+    argp.add_argument("--limit-rate", type=parse_size, metavar="RATE", help="Cap the total download speed at RATE bytes per second, e.g. 5M (0 for no cap); small files and modloader installers get bandwidth first")
+    argp.add_argument("--cache-dir", type=str, help="Where to keep downloaded files for reuse (default: ~/.cache/mrunpack)")
+    argp.add_argument("--no-cache", action='store_true', help="Don't read from or add to the download cache")
+    argp.add_argument("--race-mirrors", action='store_true', help="Request the first two mirrors of each file at once and keep the faster one")
+    argp.add_argument("--side", choices=SIDES, help="Install for the client or a dedicated server; files unsupported on that side are skipped (default: client)")
+    argp.add_argument("--no-optional", action='store_true', help="Skip files the pack marks optional for this side")
+    argp.add_argument("--include", action='append', metavar="GLOB", help="Always install optional files whose path matches GLOB (repeatable)")
+    argp.add_argument("--exclude", action='append', metavar="GLOB", help="Skip optional files whose path matches GLOB (repeatable)")
+    argp.add_argument("--link-mode", choices=LINK_MODES, default="move", help="How to place the unpacked instance into the profile directory; falls back to copy when unsupported (default: move)")
+    argp.add_argument("--metrics-out", type=str, metavar="PATH", help="Write phase timings, per-file download stats and a summary to PATH as JSON")
+    argp.add_argument("--progress-json", type=str, metavar="PATH", help="Stream download progress to PATH as JSON lines, e.g. a pipe read by a GUI (- for stdout, which moves other messages to stderr)")
+    argp.add_argument("--no-progress", action='store_true', help="Don't draw the download progress bar")
+    argp.add_argument("--plan", action='store_true', help="Print what would be downloaded, reused and how much disk it needs as JSON, then exit without installing")
+
+def run_cancellable(function, *args, **kwargs):
+    """
+    Runs function(*args, cancel=event, **kwargs) on a worker thread, so Ctrl-C can stop it cleanly:
+    the event is set, the function winds down keeping what it has downloaded, and KeyboardInterrupt is raised again.
+    """
+    cancel = threading.Event()
+    worker = ThreadPoolExecutor(max_workers=1)
+    future = worker.submit(function, *args, cancel=cancel, **kwargs)
+    try:
+        return future.result()
+    except KeyboardInterrupt:
+        cancel.set()
+        wait([future])
+        raise
+    finally:
+        worker.shutdown()
+
+def open_progress(args):
+    """The Progress asked for on the command line, or None for the default bar"""
+    if args.progress_json is None and not args.no_progress:
+        return None
+    stream = None
+    if args.progress_json == "-":
+        # The JSON lines get stdout to themselves; everything print()ed goes to stderr instead
+        stream, sys.stdout = sys.stdout, sys.stderr
+    elif args.progress_json is not None:
+        stream = open(args.progress_json, 'w', encoding='utf-8')
+    return Progress(bar=not args.no_progress, stream=stream)
+
+def close_progress(progress: Optional[Progress]):
+    if progress is None:
+        return
+    progress.close()
+    if progress.stream not in (None, sys.stdout, sys.__stdout__):
+        progress.stream.close()
+
+def write_metrics(metrics: Optional[Metrics], path: Optional[str]):
+    """Save the report asked for with --metrics-out, even when the install failed"""
+    if metrics is None:
+        return
+    try:
+        metrics.write(path)
+        print(f"{metrics.describe()}. Metrics written to {path}")
+    except OSError as e:
+        print(f"Couldn't write metrics to {path}: {e}")
+
+if __name__ == "__main__" and sys.argv[1:2] == ["gc"]:
+    argp = argparse.ArgumentParser(prog="mrunpack gc", description="Delete cached files that installed instances no longer need")
+    argp.add_argument("--cache-dir", type=str, help="The download cache to clean up (default: ~/.cache/mrunpack)")
+    argp.add_argument("--max-size", type=parse_size, help="Also delete the least recently used files still in use until the cache's own copies fit in SIZE, e.g. 20G; files an instance links to are kept")
+    argp.add_argument("--grace", type=float, default=3600, help="Keep files stored or used in the last this many seconds (default: 3600)")
+    argp.add_argument("--relink", action='store_true', help="First replace instances' own copies of cached files with hardlinks to the cache")
+    argp.add_argument("-n", "--dry-run", action='store_true', help="Only report what would be deleted")
+    argp.add_argument("--json", action='store_true', help="Print the report as JSON")
+    args = argp.parse_args(sys.argv[2:])
+    cache = FileCache(args.cache_dir)
+    report = collect_garbage(cache, args.max_size, args.grace, args.relink, args.dry_run)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        exit(0)
+    would = "Would remove" if args.dry_run else "Removed"
+    for instance in report["pruned"]:
+        print(f"{instance} is gone, dropping its references")
+    if args.relink:
+        print(f"{'Would save' if args.dry_run else 'Saved'} {report['relinked'] / 1048576:.1f} MiB by linking instance files to the cache")
+    print(f"{would} {report['removed']} cached files, freeing {report['freed'] / 1048576:.1f} MiB")
+    print(f"{cache.root} holds {report['files']} files ({report['size'] / 1048576:.1f} MiB) used by {report['instances']} instances")
+elif __name__ == "__main__" and sys.argv[1:2] == ["serve"]:
+    argp = argparse.ArgumentParser(prog="mrunpack serve", description="Run install, verify and get-defaults requests from a local socket, keeping connections and caches warm between them")
+    argp.add_argument("--socket", type=str, default=default_socket_path(), help=f"Unix socket to listen on (default: {default_socket_path()})")
+    argp.add_argument("--workers", type=int, default=2, help="Number of requests to work on at the same time (default: 2)")
+    argp.add_argument("--minecraft-dir", type=str, help="Path to .minecraft for install requests that don't name one; without it they only install the instance")
+    argp.add_argument("-j", "--jobs", type=int, default=8, help="Number of files to download at once, across all requests (default: 8)")
+    argp.add_argument("--per-host", type=int, default=4, help="Maximum simultaneous downloads from one host (default: 4)")
+    argp.add_argument("--limit-rate", type=parse_size, metavar="RATE", help="Cap the total download speed across all requests at RATE bytes per second, e.g. 5M (0 for no cap)")
+    argp.add_argument("--cache-dir", type=str, help="Where to keep downloaded files for reuse (default: ~/.cache/mrunpack)")
+    argp.add_argument("--no-cache", action='store_true', help="Don't read from or add to the download cache")
+    argp.add_argument("--race-mirrors", action='store_true', help="Request the first two mirrors of each file at once and keep the faster one")
+    args = argp.parse_args(sys.argv[2:])
+    default_bandwidth.set_rate(args.limit_rate)
+    service = InstallService(args.workers, args.jobs, args.per_host, not args.no_cache, args.cache_dir, args.race_mirrors, args.minecraft_dir)
+    print(f"Listening on {args.socket}")
+    try:
+        serve(args.socket, service)
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"Couldn't listen on {args.socket}: {e}")
+        exit(1)
+    finally:
+        service.close()
+elif __name__ == "__main__" and sys.argv[1:2] == ["verify"]:
+    argp = argparse.ArgumentParser(prog="mrunpack verify", description="Check an installed instance against its pack and optionally repair it")
+    argp.add_argument("input_mrpack", help="Path to the mrpack file the instance was installed from")
+    argp.add_argument("instance_dir", help="The installed instance")
+    argp.add_argument("--repair", action='store_true', help="Download missing and corrupt files again")
+    argp.add_argument("--workers", type=int, help="Number of processes to hash files with (default: one per CPU)")
+    argp.add_argument("--json", action='store_true', help="Print the report as JSON")
+    add_install_arguments(argp)
+    args = argp.parse_args(sys.argv[2:])
+    default_bandwidth.set_rate(args.limit_rate)
+    metrics = Metrics() if args.metrics_out else None
+    progress = open_progress(args)
+    try:
+        report = verify_mrpack(args.input_mrpack, os.path.abspath(args.instance_dir), args.repair, args.workers, args.jobs, args.per_host, not args.no_cache, args.cache_dir,
+                               args.race_mirrors, args.side, not args.no_optional, args.include, args.exclude, metrics, progress)
+    except InstallError as e:
+        print(e)
+        exit(1)
+    finally:
+        close_progress(progress)
+        write_metrics(metrics, args.metrics_out)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    if report.get("failed") or (not args.repair and (report["missing"] or report["corrupt"])):
+        exit(1)
+elif __name__ == "__main__" and sys.argv[1:2] == ["install"]:
+    argp = argparse.ArgumentParser(prog="mrunpack install", description="Install several .mrpack files at once, downloading files they share only once")
+    argp.add_argument("packs", nargs="+", help=".mrpack files, directories containing them, or glob patterns")
+    argp.add_argument("--parallel", type=int, default=2, help="Number of packs to install at the same time (default: 2)")
+    add_install_arguments(argp)
+    args = argp.parse_args(sys.argv[2:])
+    default_bandwidth.set_rate(args.limit_rate)
+    if args.plan:
+        plans = {}
+        for pack in find_packs(args.packs):
+            try:
+                    plans[pack] = unpack_mrpack(pack, minecraft_dir=args.minecraft_dir or "Default", use_cache=not args.no_cache, cache_dir=args.cache_dir, link_mode=args.link_mode,
+                                            side=args.side or "client", optional=not args.no_optional, include=args.include, exclude=args.exclude,
+                                            workspace=pack_workspace(pack), plan_only=True)
+            except InstallError as e:
+                plans[pack] = {"error": str(e)}
+        print(json.dumps(plans, indent=2))
+        exit(0)
+    metrics = Metrics() if args.metrics_out else None
+    progress = open_progress(args)
+    try:
+        failed = run_cancellable(install_packs, args.packs, args.minecraft_dir or "Default", args.jobs, args.per_host, not args.no_cache, args.cache_dir, args.link_mode,
+                                 args.race_mirrors, args.side or "client", not args.no_optional, args.include, args.exclude, args.parallel, metrics, progress)
+    except KeyboardInterrupt:
+        print("Cancelled. Run the same command again to resume the install.")
+        exit(1)
+    finally:
+        close_progress(progress)
+        write_metrics(metrics, args.metrics_out)
+    if failed:
+        exit(1)
+elif __name__ == "__main__":
     argp = argparse.ArgumentParser(description="A simple terminal program to unpack a .mrpack file")
     argp.add_argument("input_mrpack", help="Path to the mrpack file")
     argp.add_argument("-d", "--dryrun", action='store_true', help="Don't copy files, just unpack.")
     argp.add_argument("--get-defaults", action='store_true', help="Show default options for the mrpack file and exit")
-    argp.add_argument("--minecraft-dir", type=str, help="Path to .minecraft directory (auto-detected if not provided)")
+    argp.add_argument("--upgrade", action='store_true', help="Upgrade an existing install of this pack in place, only touching files that changed")
     argp.add_argument("--profile-dir", type=str, help="Directory to install the modpack (default: .minecraft/{profile_name})")
     argp.add_argument("--profile-name", type=str, help="Name for the launcher profile (default: name from mrpack metadata)")
+    add_install_arguments(argp)
     args = argp.parse_args()
+    default_bandwidth.set_rate(args.limit_rate)
+    metrics = Metrics() if args.metrics_out else None
+    progress = None if args.get_defaults or args.plan else open_progress(args)
     
     if args.get_defaults:
         get_defaults(args.input_mrpack)
+    elif args.upgrade:
+        minecraft_dir = args.minecraft_dir if args.minecraft_dir else "Default"
+        if args.profile_dir is not None:
+            instance_path = os.path.abspath(args.profile_dir)
+        else:
+            instance_path = os.path.join(minecraft_dir_path(minecraft_dir), args.profile_name or read_index(args.input_mrpack).get("name"))
+        try:
+            if args.plan:
+                print(json.dumps(upgrade_mrpack(args.input_mrpack, instance_path, minecraft_dir, use_cache=not args.no_cache, cache_dir=args.cache_dir,
+                                                side=args.side, optional=not args.no_optional, include=args.include, exclude=args.exclude, plan_only=True), indent=2))
+            else:
+                run_cancellable(upgrade_mrpack, args.input_mrpack, instance_path, minecraft_dir, args.jobs, args.per_host, not args.no_cache, args.cache_dir,
+                                args.race_mirrors, args.side, not args.no_optional, args.include, args.exclude, metrics, progress)
+        except InstallError as e:
+            print(e)
+            if e.step == "files":
+                print("Run the same command again to resume the upgrade.")
+            exit(1)
+        except KeyboardInterrupt:
+            print("Cancelled. Run the same command again to resume the upgrade.")
+            exit(1)
+        finally:
+            close_progress(progress)
+            write_metrics(metrics, args.metrics_out)
     else:
         # Prepare arguments for unpack_mrpack
         minecraft_dir = args.minecraft_dir if args.minecraft_dir else "Default"
         profile_dir = args.profile_dir
         profile_name = args.profile_name
         
-        unpack_mrpack(args.input_mrpack, args.dryrun, minecraft_dir, profile_dir, profile_name)
+        try:
+            if args.plan:
+                print(json.dumps(unpack_mrpack(args.input_mrpack, args.dryrun, minecraft_dir, profile_dir, profile_name, use_cache=not args.no_cache,
+                                               cache_dir=args.cache_dir, link_mode=args.link_mode, side=args.side or "client", optional=not args.no_optional,
+                                               include=args.include, exclude=args.exclude, plan_only=True), indent=2))
+            else:
+                run_cancellable(unpack_mrpack, args.input_mrpack, args.dryrun, minecraft_dir, profile_dir, profile_name,
+                                jobs=args.jobs, per_host=args.per_host, use_cache=not args.no_cache, cache_dir=args.cache_dir,
+                                link_mode=args.link_mode, race_mirrors=args.race_mirrors, side=args.side or "client",
+                                optional=not args.no_optional, include=args.include, exclude=args.exclude,
+                                confirm=lambda message: input(f"{message} (y/N) ").lower() == 'y', metrics=metrics, progress=progress)
+        except InstallError as e:
+            print(e)
+            if e.step == "files":
+                print("Run the same command again to resume the install.")
+            elif e.step == "place":
+                print(f"The unpacked files are still in {os.path.abspath('instance')}")
+            exit(1)
+        except KeyboardInterrupt:
+            print("Cancelled. Run the same command again to resume the install.")
+            exit(1)
+        finally:
+            close_progress(progress)
+            write_metrics(metrics, args.metrics_out)
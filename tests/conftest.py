@@ -0,0 +1,41 @@
+import hashlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import make_pack, start_cdn
+from lib import read_index
+
+
+def entry_for(path: str, data: bytes, downloads: list):
+    """A modrinth.index.json "files" entry for data"""
+    return {
+        "path": path,
+        "hashes": {"sha1": hashlib.sha1(data).hexdigest(), "sha512": hashlib.sha512(data).hexdigest()},
+        "env": {"client": "required", "server": "required"},
+        "downloads": downloads,
+        "fileSize": len(data)
+    }
+
+
+@pytest.fixture
+def cdn(tmp_path):
+    """bench.py's stand-in CDN, serving tmp_path/cdn"""
+    root = tmp_path / "cdn"
+    root.mkdir()
+    server = start_cdn(str(root))
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def pack(tmp_path, cdn):
+    """A small synthetic pack whose files cdn serves. Returns (mrpack path, parsed index)"""
+    mrpack_path, _ = make_pack(str(tmp_path), cdn.url, files=12, median_size=64 * 1024, spread=0.5,
+                               max_size=256 * 1024, overrides=3, override_size=256)
+    return mrpack_path, read_index(mrpack_path)
@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+
+import pytest
+
+from conftest import entry_for
+from lib import Downloader, DownloadCancelled, FileCache, download_files, hash_file, install_instance
+
+
+def installed_correctly(target: str, index: dict):
+    return all(hash_file(os.path.join(target, entry["path"]), "sha1") == entry["hashes"]["sha1"] for entry in index["files"])
+
+
+def test_cancelled_install_resumes(tmp_path, cdn, pack):
+    mrpack_path, index = pack
+    target, workspace = str(tmp_path / "instance"), str(tmp_path / "work")
+    staging_dir = os.path.join(workspace, "instance")
+    # Slow enough that every file is still in flight when the install is cancelled
+    cdn.bandwidth = 32 * 1024
+    cancel = threading.Event()
+    errors = []
+
+    def install():
+        try:
+            install_instance(mrpack_path, target, workspace=workspace, use_cache=False, jobs=4, cancel=cancel)
+        except Exception as e:
+            errors.append(e)
+
+    worker = threading.Thread(target=install)
+    worker.start()
+    deadline = time.monotonic() + 10
+    while not any(name.endswith(".part") and os.path.getsize(os.path.join(root, name))
+                  for root, _, names in os.walk(staging_dir) for name in names):
+        assert time.monotonic() < deadline, "no download started"
+        time.sleep(0.05)
+    cancel.set()
+    worker.join(10)
+    assert not worker.is_alive()
+    assert len(errors) == 1 and isinstance(errors[0], DownloadCancelled)
+    # What was downloaded stays behind for the next run
+    assert os.path.isfile(os.path.join(workspace, "instance.journal.json"))
+    assert not os.path.exists(target)
+
+    cdn.bandwidth = 0
+    fetched = cdn.stats["bytes"]
+    summary = install_instance(mrpack_path, target, workspace=workspace, use_cache=False, jobs=4)
+    assert summary["resumed"]
+    assert cdn.stats["bytes"] - fetched < sum(entry["fileSize"] for entry in index["files"])
+    assert installed_correctly(target, index)
+    assert not os.path.exists(workspace)
+
+
+@pytest.mark.parametrize("race", [False, True])
+def test_hash_mismatch_moves_to_next_mirror(tmp_path, cdn, race):
+    good, bad = os.urandom(100 * 1024), os.urandom(100 * 1024)
+    (tmp_path / "cdn" / "good.jar").write_bytes(good)
+    (tmp_path / "cdn" / "bad.jar").write_bytes(bad)
+    entry = entry_for("mods/a.jar", good, [f"{cdn.url}/bad.jar", f"{cdn.url}/good.jar"])
+    dest_dir = str(tmp_path / "instance")
+    failures = download_files([entry], dest_dir, downloader=Downloader(backoff=0, race=race))
+    assert failures == []
+    with open(os.path.join(dest_dir, "mods", "a.jar"), 'rb') as f:
+        assert f.read() == good
+
+
+def test_race_drops_missing_mirror(tmp_path, cdn):
+    data = os.urandom(50 * 1024)
+    (tmp_path / "cdn" / "a.jar").write_bytes(data)
+    entry = entry_for("mods/a.jar", data, [f"{cdn.url}/missing.jar", f"{cdn.url}/gone.jar", f"{cdn.url}/a.jar"])
+    failures = download_files([entry], str(tmp_path / "instance"), downloader=Downloader(backoff=0, race=True))
+    assert failures == []
+    # Both raced mirrors 404 and are never asked again
+    assert cdn.stats["requests"] == 3
+    assert hash_file(str(tmp_path / "instance" / "mods" / "a.jar"), "sha1") == entry["hashes"]["sha1"]
+
+
+def test_corrupt_cache_entry_is_detected(tmp_path, cdn, pack):
+    _, index = pack
+    entry = index["files"][0]
+    cache = FileCache(str(tmp_path / "cache"))
+    assert download_files([entry], str(tmp_path / "first"), cache=cache) == []
+    blob = cache.lookup(entry["hashes"])
+    assert blob is not None
+    if os.name != "nt":
+        assert os.stat(blob).st_mode & 0o222 == 0
+    # Same size, different content: only hashing it again catches this
+    os.chmod(blob, 0o644)
+    with open(blob, 'r+b') as f:
+        f.write(b"\0" * 16)
+
+    requests = cdn.stats["requests"]
+    assert download_files([entry], str(tmp_path / "second"), cache=cache) == []
+    assert cdn.stats["requests"] > requests
+    assert hash_file(str(tmp_path / "second" / entry["path"]), "sha1") == entry["hashes"]["sha1"]
+    assert hash_file(cache.lookup(entry["hashes"]), "sha1") == entry["hashes"]["sha1"]
@@ -0,0 +1,51 @@
+import hashlib
+import os
+import shutil
+
+from lib import FileCache, collect_garbage, install_instance
+
+
+def test_gc_keeps_files_until_no_instance_uses_them(tmp_path, cdn, pack):
+    mrpack_path, index = pack
+    cache_dir = str(tmp_path / "cache")
+    first, second = str(tmp_path / "first"), str(tmp_path / "second")
+    for target in (first, second):
+        install_instance(mrpack_path, target, workspace=str(tmp_path / "work"), cache_dir=cache_dir)
+    cache = FileCache(cache_dir)
+    stray = tmp_path / "stray.jar"
+    stray.write_bytes(b"no instance uses this")
+    cache.store({"sha1": hashlib.sha1(stray.read_bytes()).hexdigest()}, str(stray))
+    stray.unlink()
+
+    report = collect_garbage(cache, grace=0)
+    assert report["instances"] == 2
+    assert report["removed"] == 1
+    assert report["files"] == len(index["files"])
+    # Every remaining file is hardlinked from an instance, so a size cap frees nothing by deleting them
+    assert collect_garbage(cache, max_size=0, grace=0)["removed"] == 0
+
+    shutil.rmtree(first)
+    report = collect_garbage(cache, grace=0)
+    assert report["pruned"] == [first]
+    assert report["instances"] == 1
+    assert report["removed"] == 0
+
+    shutil.rmtree(second)
+    report = collect_garbage(cache, grace=0, dryrun=True)
+    assert report["pruned"] == [second]
+    assert report["removed"] == len(index["files"])
+    assert len(list(cache.blobs())) == len(index["files"])
+    report = collect_garbage(cache, grace=0)
+    assert report["freed"] == sum(entry["fileSize"] for entry in index["files"])
+    assert list(cache.blobs()) == []
+    assert list(cache.refs()) == []
+
+
+def test_gc_grace_keeps_fresh_files(tmp_path):
+    cache = FileCache(str(tmp_path / "cache"))
+    blob = tmp_path / "blob.jar"
+    blob.write_bytes(b"just stored")
+    cache.store({"sha1": hashlib.sha1(blob.read_bytes()).hexdigest()}, str(blob))
+    assert collect_garbage(cache)["removed"] == 0
+    assert collect_garbage(cache, grace=0)["removed"] == 1
+    assert not os.listdir(os.path.join(cache.root, "sha1", hashlib.sha1(b"just stored").hexdigest()[:2]))
@@ -0,0 +1,42 @@
+import json
+import multiprocessing
+import threading
+
+from lib import add_modpack_profile, add_modpack_profiles, launcher_profiles_transaction, load_launcher_profiles
+
+WRITES = 10
+
+
+def add_profiles(minecraft_path: str, name: str):
+    for i in range(WRITES):
+        with launcher_profiles_transaction(minecraft_path) as profiles_data:
+            add_modpack_profile(profiles_data, f"{name}-{i}", "1.21.1", "fabric-loader-0.16.14-1.21.1", f"/instances/{name}-{i}")
+
+
+def test_concurrent_writers_keep_every_profile(tmp_path):
+    minecraft_path = str(tmp_path)
+    (tmp_path / "launcher_profiles.json").write_text(json.dumps({"profiles": {}, "settings": {}, "version": 3}))
+    writers = [threading.Thread(target=add_profiles, args=(minecraft_path, f"thread{n}")) for n in range(4)]
+    # Other mrunpack processes only share the file lock
+    context = multiprocessing.get_context("spawn")
+    writers += [context.Process(target=add_profiles, args=(minecraft_path, f"process{n}")) for n in range(4)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join(60)
+    assert all(writer.exitcode == 0 for writer in writers if isinstance(writer, multiprocessing.process.BaseProcess))
+
+    profiles = load_launcher_profiles(minecraft_path)["profiles"].values()
+    assert sorted(profile["name"] for profile in profiles) == sorted(
+        f"{kind}{n}-{i}" for kind in ("thread", "process") for n in range(4) for i in range(WRITES))
+
+
+def test_add_modpack_profiles_writes_once(tmp_path):
+    minecraft_path = str(tmp_path)
+    (tmp_path / "launcher_profiles.json").write_text(json.dumps({"profiles": {"keep": {"name": "Existing"}}, "version": 3}))
+    ids = add_modpack_profiles(minecraft_path, [
+        {"profile_name": name, "minecraft_version": "1.21.1", "modloader_version": "1.21.1", "game_dir": f"/instances/{name}"}
+        for name in ("A", "B")])
+    profiles = load_launcher_profiles(minecraft_path)["profiles"]
+    assert profiles["keep"]["name"] == "Existing"
+    assert [profiles[profile_id]["name"] for profile_id in ids] == ["A", "B"]
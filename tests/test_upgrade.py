@@ -0,0 +1,65 @@
+import json
+import os
+import zipfile
+
+from conftest import entry_for
+from lib import diff_manifests, hash_file, install_instance, read_install_record
+from main import upgrade_mrpack
+
+
+def next_version(tmp_path, cdn, mrpack_path: str, index: dict):
+    """Write version 2 of the pack: the first file changed, the second removed and one added"""
+    files = [dict(entry) for entry in index["files"]]
+    changed = os.urandom(files[0]["fileSize"])
+    (tmp_path / "cdn" / "changed.jar").write_bytes(changed)
+    files[0] = entry_for(files[0]["path"], changed, [f"{cdn.url}/changed.jar"])
+    added = os.urandom(10 * 1024)
+    (tmp_path / "cdn" / "added.jar").write_bytes(added)
+    files = files[:1] + files[2:] + [entry_for("mods/added.jar", added, [f"{cdn.url}/added.jar"])]
+    new_index = dict(index, versionId="2.0.0", files=files)
+    new_path = str(tmp_path / "v2.mrpack")
+    with zipfile.ZipFile(mrpack_path) as old, zipfile.ZipFile(new_path, 'w') as new:
+        new.writestr("modrinth.index.json", json.dumps(new_index))
+        for name in old.namelist():
+            if name.startswith("overrides/"):
+                new.writestr(name, old.read(name))
+    return new_path, new_index
+
+
+def test_diff_manifests(tmp_path, cdn, pack):
+    mrpack_path, index = pack
+    _, new_index = next_version(tmp_path, cdn, mrpack_path, index)
+    plan = diff_manifests(index["files"], new_index["files"])
+    assert [entry["path"] for entry in plan["changed"]] == [index["files"][0]["path"]]
+    assert [entry["path"] for entry in plan["removed"]] == [index["files"][1]["path"]]
+    assert [entry["path"] for entry in plan["added"]] == ["mods/added.jar"]
+    assert len(plan["unchanged"]) == len(index["files"]) - 2
+
+
+def test_diff_manifests_refetches_missing_files(tmp_path, pack):
+    _, index = pack
+    instance = tmp_path / "instance"
+    for entry in index["files"][1:]:
+        (instance / entry["path"]).parent.mkdir(parents=True, exist_ok=True)
+        (instance / entry["path"]).write_bytes(b"")
+    plan = diff_manifests(index["files"], index["files"], str(instance))
+    assert [entry["path"] for entry in plan["changed"]] == [index["files"][0]["path"]]
+    assert not plan["added"] and not plan["removed"]
+
+
+def test_upgrade_only_touches_what_changed(tmp_path, cdn, pack):
+    mrpack_path, index = pack
+    target = str(tmp_path / "instance")
+    install_instance(mrpack_path, target, workspace=str(tmp_path / "work"), use_cache=False)
+    new_path, new_index = next_version(tmp_path, cdn, mrpack_path, index)
+    kept = os.path.join(target, index["files"][2]["path"])
+    inode = os.stat(kept).st_ino
+
+    requests = cdn.stats["requests"]
+    upgrade_mrpack(new_path, target, use_cache=False)
+    assert cdn.stats["requests"] - requests == 2
+    assert not os.path.exists(os.path.join(target, index["files"][1]["path"]))
+    for entry in new_index["files"]:
+        assert hash_file(os.path.join(target, entry["path"]), "sha1") == entry["hashes"]["sha1"]
+    assert os.stat(kept).st_ino == inode
+    assert read_install_record(target)["index"]["versionId"] == "2.0.0"